@@ -1,6 +1,28 @@
-import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import copy
+import io
 import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import numpy as np
 import tree_sitter
+from rhl import (
+    batch_qsim,
+    environment,
+    estimate_qsim,
+    factorized_qsim,
+    partitioned_qsim,
+    qsim,
+    sampling_qsim,
+    sparse_qsim,
+    stabilizer_qsim,
+    trace,
+)
 from rhl.interpreter import Interpreter
 from rhl.exceptions import RHLResolverError, RHLRuntimeError
 from rhl.resolver import Resolver
@@ -8,6 +30,20 @@ from rhl.node import Node, State
 import rhl.builtins
 
 
+PRECISIONS = {
+    "single": np.complex64,
+    "double": np.complex128,
+}
+
+BACKENDS: dict[str, type[qsim.BaseQSimulator]] = {
+    "dense": qsim.QSimulator,
+    "sparse": sparse_qsim.SparseQSimulator,
+    "factorized": factorized_qsim.FactorizedQSimulator,
+    "partitioned": partitioned_qsim.PartitionedQSimulator,
+    "stabilizer": stabilizer_qsim.StabilizerQSimulator,
+}
+
+
 def setup_logging():
     logging.basicConfig(
         format="[%(levelname)s] %(name)s - %(message)s", level=logging.WARNING
@@ -22,19 +58,288 @@ def get_ts_parser() -> tree_sitter.Parser:
     return parser
 
 
-def main():
+def parse_args() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input_path", nargs="?")
+    arg_parser.add_argument(
+        "--qubits",
+        type=int,
+        default=qsim.BaseQSimulator.NUM_QUBITS,
+        help="number of qubits in the simulator register",
+    )
+    arg_parser.add_argument(
+        "--grow",
+        action="store_true",
+        help="add qubits to the register when qalloc runs out of free qubits",
+    )
+    arg_parser.add_argument(
+        "--backend",
+        choices=["auto", *BACKENDS.keys()],
+        default="auto",
+        help="state representation used by the simulator (auto picks the "
+        "stabilizer backend for Clifford-only programs and dense otherwise)",
+    )
+    arg_parser.add_argument(
+        "--shots",
+        type=int,
+        default=1,
+        help="run the program this many times, sampling repeated measured "
+        "circuits from a single simulation",
+    )
+    arg_parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="run all the shots at once on a (shots, 2^n) state array; "
+        "measurements then yield one value per shot",
+    )
+    arg_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="split the shots between this many forked worker processes, "
+        "each with an independent random stream",
+    )
+    arg_parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="worker threads used by the dense simulator on large registers",
+    )
+    arg_parser.add_argument(
+        "--partitions",
+        type=int,
+        default=2,
+        help="number of worker processes (a power of two) the partitioned "
+        "backend splits the state vector between",
+    )
+    arg_parser.add_argument(
+        "--memmap",
+        metavar="PATH",
+        help="keep the dense state vector in a memory-mapped file at PATH, "
+        "for registers larger than RAM (--backend auto then picks dense)",
+    )
+    arg_parser.add_argument(
+        "--precision",
+        choices=PRECISIONS.keys(),
+        default="double",
+        help="floating point precision of the state vector amplitudes",
+    )
+    arg_parser.add_argument(
+        "--seed",
+        type=int,
+        help="seed for the simulator's random number generator, to make "
+        "measurement outcomes reproducible",
+    )
+    arg_parser.add_argument(
+        "--estimate",
+        action="store_true",
+        help="run one shot without simulating amplitudes and report the "
+        "qubits, gates, measurements and depth the program uses",
+    )
+    arg_parser.add_argument(
+        "--outcomes",
+        choices=estimate_qsim.OUTCOME_POLICIES,
+        default="random",
+        help="measurement outcomes returned during --estimate",
+    )
+    arg_parser.add_argument(
+        "--record",
+        metavar="TRACE",
+        help="write the simulator calls made by the program to TRACE",
+    )
+    arg_parser.add_argument(
+        "--replay",
+        metavar="TRACE",
+        help="run the simulator calls recorded in TRACE instead of a program",
+    )
+    arg_parser.add_argument(
+        "--resample",
+        action="store_true",
+        help="sample the measurements of --replay again instead of collapsing onto "
+        "the recorded outcomes",
+    )
+
+    args = arg_parser.parse_args()
+    if (args.input_path is None) == (args.replay is None):
+        arg_parser.error("expected exactly one of input_path or --replay")
+    if args.resample and not args.replay:
+        arg_parser.error("--resample can only be used with --replay")
+    if args.record and args.batch:
+        arg_parser.error("--record cannot be used with --batch")
+    if args.memmap and (
+        args.backend not in ("auto", "dense") or args.batch or args.estimate
+    ):
+        arg_parser.error("--memmap can only be used with the dense backend")
+    if args.workers > 1 and (args.batch or args.memmap or args.replay):
+        arg_parser.error("--workers cannot be used with --batch, --memmap or --replay")
+    if args.estimate and (
+        args.shots > 1 or args.batch or args.workers > 1 or args.record or args.replay
+    ):
+        arg_parser.error(
+            "--estimate cannot be used with --shots, --batch, --workers, --record "
+            "or --replay"
+        )
+    return args
+
+
+def create_simulator(args: argparse.Namespace, backend: str) -> qsim.BaseQSimulator:
+    if args.batch:
+        return batch_qsim.BatchQSimulator(
+            num_qubits=args.qubits,
+            growable=args.grow,
+            shots=args.shots,
+            dtype=PRECISIONS[args.precision],
+            seed=args.seed,
+        )
+    if backend == "dense" and args.shots > 1:
+        return sampling_qsim.SamplingQSimulator(
+            num_qubits=args.qubits,
+            growable=args.grow,
+            threads=args.threads,
+            memmap_path=args.memmap,
+            dtype=PRECISIONS[args.precision],
+            shots=args.shots,
+            seed=args.seed,
+        )
+    if backend == "dense":
+        return qsim.QSimulator(
+            num_qubits=args.qubits,
+            growable=args.grow,
+            threads=args.threads,
+            memmap_path=args.memmap,
+            dtype=PRECISIONS[args.precision],
+            seed=args.seed,
+        )
+    if backend == "factorized":
+        return factorized_qsim.FactorizedQSimulator(
+            num_qubits=args.qubits,
+            growable=args.grow,
+            dtype=PRECISIONS[args.precision],
+            seed=args.seed,
+        )
+    if backend == "partitioned":
+        return partitioned_qsim.PartitionedQSimulator(
+            num_qubits=args.qubits,
+            growable=args.grow,
+            partitions=args.partitions,
+            dtype=PRECISIONS[args.precision],
+            seed=args.seed,
+        )
+    return BACKENDS[backend](num_qubits=args.qubits, growable=args.grow, seed=args.seed)
+
+
+def replay(args: argparse.Namespace) -> None:
+    backend = "dense" if args.backend == "auto" else args.backend
+    simulator = create_simulator(args, backend)
+
+    start = time.perf_counter()
+    operations, mismatches = trace.replay(args.replay, simulator, args.resample)
+    elapsed = time.perf_counter() - start
+    message = f"Replayed {operations} operations in {elapsed:.3f}s"
+    if args.resample:
+        message += f" ({mismatches} measurements differ from the trace)"
+    print(message, file=sys.stderr)
+
+
+def estimate(args: argparse.Namespace, root: Node) -> int:
+    logger = logging.getLogger(__name__)
+
+    simulator = estimate_qsim.EstimatingQSimulator(
+        num_qubits=args.qubits, outcomes=args.outcomes, seed=args.seed
+    )
+    environment.set_qsim(simulator)
     try:
-        path = sys.argv[1]
-    except IndexError:
-        print(f"Usage: {sys.argv[0]} 'input_path'")
-        return -1
+        Interpreter().execute(root)
+    except RHLRuntimeError as ex:
+        logger.error(ex)
+        return -3
+    print(simulator.report(), file=sys.stderr)
+    return 0
 
-    with open(path, "rb") as f:
-        source = f.read()
 
+def run_shots(args: argparse.Namespace, backend: str, root: Node) -> int:
+    logger = logging.getLogger(__name__)
+
+    simulator = create_simulator(args, backend)
+    if args.record:
+        simulator = trace.TraceRecorder(simulator, args.record)
+    environment.set_qsim(simulator)
+
+    try:
+        for _ in range(1 if args.batch else args.shots):
+            simulator.new_shot()
+
+            interpreter = Interpreter()
+            try:
+                interpreter.execute(root)
+            except RHLRuntimeError as ex:
+                logger.error(ex)
+                return -3
+    finally:
+        if isinstance(simulator, trace.TraceRecorder):
+            simulator.close()
+    return 0
+
+
+# Set before forking the workers, which inherit it instead of unpickling a
+# parse tree.
+_worker_program: tuple[argparse.Namespace, str, Node] | None = None
+
+
+def run_worker(index: int, shots: int, seed: np.random.SeedSequence) -> tuple[int, str]:
+    args, backend, root = _worker_program
+    args = copy.copy(args)
+    args.shots = shots
+    args.seed = seed
+    if args.record:
+        args.record = f"{args.record}.{index}"
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        status = run_shots(args, backend, root)
+    return status, output.getvalue()
+
+
+def run_workers(args: argparse.Namespace, backend: str, root: Node) -> int:
+    global _worker_program
+    _worker_program = (args, backend, root)
+
+    workers = max(1, min(args.workers, args.shots))
+    shares = [args.shots // workers + (i < args.shots % workers) for i in range(workers)]
+    seeds = np.random.SeedSequence(args.seed).spawn(workers)
+    # Pool processes are daemonic and couldn't start the partitioned
+    # backend's own workers.
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        results = list(pool.map(run_worker, range(workers), shares, seeds))
+
+    # Outputs and traces are merged in worker order, so the result reads like
+    # a sequential run of the same shots.
+    for _, output in results:
+        sys.stdout.write(output)
+    if args.record:
+        with open(args.record, "wb") as merged:
+            merged.write(trace.MAGIC)
+            for index in range(workers):
+                with open(f"{args.record}.{index}", "rb") as part:
+                    part.seek(len(trace.MAGIC))
+                    shutil.copyfileobj(part, merged)
+                os.remove(f"{args.record}.{index}")
+
+    return next((status for status, _ in results if status != 0), 0)
+
+
+def main():
+    args = parse_args()
     setup_logging()
     logger = logging.getLogger(__name__)
 
+    if args.replay:
+        return replay(args)
+
+    with open(args.input_path, "rb") as f:
+        source = f.read()
+
     parser = get_ts_parser()
     tree = parser.parse(source)
     state = State()
@@ -50,12 +355,23 @@ def main():
     if state.has_errors:
         return -2
 
-    interpreter = Interpreter()
-    try:
-        interpreter.execute(root)
-    except RHLRuntimeError as ex:
-        logger.error(ex)
-        return -3
+    if args.estimate:
+        return estimate(args, root)
+
+    backend = args.backend
+    if backend == "auto":
+        # A memory-mapped state vector only exists in the dense backend.
+        if not args.memmap and stabilizer_qsim.is_clifford_program(
+            resolver.builtin_references, resolver.builtin_calls
+        ):
+            backend = "stabilizer"
+        else:
+            backend = "dense"
+        logger.info(f"Using the {backend} simulator backend")
+
+    if args.workers > 1:
+        return run_workers(args, backend, root)
+    return run_shots(args, backend, root)
 
 
 if __name__ == "__main__":
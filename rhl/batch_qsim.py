@@ -0,0 +1,99 @@
+import numpy as np
+
+from . import qsim
+
+
+class BatchQSimulator(qsim.BaseQSimulator):
+    # Runs `shots` independent copies of the program in lockstep: row i of
+    # the state holds the i-th shot, gates are applied to every row at once
+    # and measurements return one outcome per shot.
+    SUPPORTS_UNITARIES = True
+
+    def __init__(
+        self,
+        num_qubits: int = qsim.BaseQSimulator.NUM_QUBITS,
+        growable: bool = False,
+        shots: int = 1,
+        dtype: type[np.complexfloating] = np.complex128,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable, seed)
+        self.shots = shots
+        self.dtype = np.dtype(dtype)
+        self.states = np.zeros((shots, 2**self.num_qubits), dtype=self.dtype)
+        self.states[:, 0] = 1
+
+    def _grow_state(self, count: int) -> None:
+        states = np.zeros((self.shots, 2 ** (self.num_qubits + count)), dtype=self.dtype)
+        states[:, : self.states.shape[1]] = self.states
+        self.states = states
+
+    def measure(self, qubit: int) -> np.ndarray:
+        zeros, ones = self._halves(qubit)
+        prob_zeros = (np.abs(zeros) ** 2).sum(axis=(1, 2))
+
+        outcomes = (self.rng.random(self.shots) >= prob_zeros).astype(int)
+        zeros[outcomes == 1] = 0
+        ones[outcomes == 0] = 0
+
+        norms = np.sqrt(np.where(outcomes == 1, 1 - prob_zeros, prob_zeros))
+        self.states /= norms[:, np.newaxis]
+        return outcomes
+
+    def _collapse(self, qubit: int, outcome: int) -> None:
+        # Every shot collapses onto the same outcome.
+        halves = self._halves(qubit)
+        probabilities = (np.abs(halves[outcome]) ** 2).sum(axis=(1, 2))
+        halves[1 - outcome][...] = 0
+        self.states *= np.array([qsim.collapse_scale(p) for p in probabilities])[:, np.newaxis]
+
+    def _reset(self, qubit: int, outcome: int | None = None) -> np.ndarray | int:
+        # After measuring, each row has only one non-zero half; moving it to
+        # the |0> half resets the qubit without branching per shot.
+        if outcome is None:
+            outcome = self.measure(qubit)
+        else:
+            self._collapse(qubit, outcome)
+        zeros, ones = self._halves(qubit)
+        zeros += ones
+        ones[...] = 0
+        return outcome
+
+    def mcz(self, qubits: list[int]) -> None:
+        qsim.negate_all_ones(self._tensor(), [self._axis(qubit) for qubit in qubits])
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        qsim.phase_all_ones(self._tensor(), [self._axis(qubit) for qubit in qubits], phase)
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        axes = tuple(self._axis(qubit) for qubit in qubits)
+        self._tensor()[...] *= qsim.diagonal_mask(self.num_qubits + 1, axes, diagonal)
+
+    def _apply_unitary(self, unitary: np.ndarray, qubits: list[int]) -> None:
+        qsim.apply_unitary(
+            self._tensor(),
+            unitary.astype(self.dtype, copy=False),
+            [self._axis(qubit) for qubit in qubits],
+        )
+
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        qsim.apply_controlled(
+            self._tensor(),
+            op.astype(self.dtype, copy=False),
+            self._axis(target),
+            [self._axis(control) for control in controls],
+        )
+
+    def _halves(self, qubit: int) -> tuple[np.ndarray, np.ndarray]:
+        view = self.states.reshape(self.shots, -1, 2, 2**qubit)
+        return view[:, :, 0, :], view[:, :, 1, :]
+
+    def _tensor(self) -> np.ndarray:
+        return self.states.reshape((self.shots,) + (2,) * self.num_qubits)
+
+    def _axis(self, qubit: int) -> int:
+        # Axis 0 is the shot index.
+        return self.num_qubits - qubit
+
+    def to_string(self) -> str:
+        return "BatchQSimulator"
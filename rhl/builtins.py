@@ -1,11 +1,21 @@
-from typing import Callable, Optional
+from typing import Any, Callable, Optional
+import numpy as np
 from . import environment, scope, interpreter, objects, types, qsim
+from .qsim import rz_matrix
+
+
+# Builtins that take the simulator, i.e. everything touching quantum state.
+QUANTUM_BUILTINS: set[str] = set()
+# Builtins without classical side effects that apply at most unitary gates,
+# i.e. that may be called from a memoized unitary subroutine.
+PURE_BUILTINS: set[str] = set()
 
 
 def register_builtin(
     name: Optional[str] = None,
     parameters: Optional[list[tuple[str, types.Type]]] = None,
     return_type: Optional[types.Type] = None,
+    pure: bool = False,
 ):
     def decorator(func: Callable):
         _name = name
@@ -50,29 +60,46 @@ def register_builtin(
         )
         environment.GLOBAL_ENV.declare(_name, func_obj)
         scope.GLOBAL_SCOPE.declare(_name, func_obj.type)
+        if qsim:
+            QUANTUM_BUILTINS.add(_name)
+        if pure:
+            PURE_BUILTINS.add(_name)
         return _func
 
     return decorator
 
 
+def register_gate(name: str, op: np.ndarray) -> None:
+    @register_builtin(
+        name=name,
+        parameters=[("qubit", types.qubit_type)],
+        return_type=types.none_type,
+        pure=True,
+    )
+    def __rhl_gate(qsim: qsim.BaseQSimulator, qubit: objects.QubitObject) -> objects.NoneObject:
+        qsim.apply(op, qubit.value)
+        return objects.NoneObject()
+
+
 @register_builtin()
 def __rhl_print(obj: objects.Object) -> objects.NoneObject:
     print(obj.to_string())
     return objects.NoneObject()
 
 
-@register_builtin()
+@register_builtin(pure=True)
 def __rhl_str(obj: objects.Object) -> objects.StringObject:
     return objects.StringObject(value=obj.to_string())
 
 
-@register_builtin()
+@register_builtin(pure=True)
 def __rhl_type(obj: objects.Object) -> objects.StringObject:
     return objects.StringObject(value=obj.type.name)
 
 
 @register_builtin(
     return_type=types.ListType.get_or_create(element_type=types.int_type),
+    pure=True,
 )
 def __rhl_range(obj: objects.IntObject) -> objects.ListObject:
     return objects.ListObject(
@@ -83,6 +110,7 @@ def __rhl_range(obj: objects.IntObject) -> objects.ListObject:
 
 @register_builtin(
     parameters=[("obj", types.ListType.get_or_create(element_type=types.any_type))],
+    pure=True,
 )
 def __rhl_len(obj: objects.ListObject) -> objects.IntObject:
     return objects.IntObject(value=len(obj.value))
@@ -102,7 +130,7 @@ def __rhl_append(l: objects.ListObject, v: objects.IntObject) -> objects.NoneObj
 @register_builtin(
     return_type=types.ListType.get_or_create(element_type=types.qubit_type),
 )
-def __rhl_qalloc(qsim: qsim.QSimulator, obj: objects.IntObject) -> objects.ListObject:
+def __rhl_qalloc(qsim: qsim.BaseQSimulator, obj: objects.IntObject) -> objects.ListObject:
     qubits = qsim.qalloc(obj.value)
     return objects.ListObject(
         value=[objects.QubitObject(value=v) for v in qubits],
@@ -115,39 +143,217 @@ def __rhl_qalloc(qsim: qsim.QSimulator, obj: objects.IntObject) -> objects.ListO
         ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
     ]
 )
-def __rhl_qfree(qsim: qsim.QSimulator, qubits: objects.ListObject) -> objects.NoneObject:
+def __rhl_qfree(qsim: qsim.BaseQSimulator, qubits: objects.ListObject) -> objects.NoneObject:
     qsim.qfree([obj.value for obj in qubits.value])
     return objects.NoneObject()
 
 
 @register_builtin()
-def __rhl_measure(qsim: qsim.QSimulator, qubit: objects.QubitObject) -> objects.IntObject:
+def __rhl_measure(qsim: qsim.BaseQSimulator, qubit: objects.QubitObject) -> objects.IntObject:
     return objects.IntObject(value=qsim.measure(qubit.value))
 
 
-@register_builtin()
-def __rhl_x(qsim: qsim.QSimulator, qubit: objects.QubitObject) -> objects.NoneObject:
+@register_builtin(
+    parameters=[
+        ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
+    ]
+)
+def __rhl_measure_all(qsim: qsim.BaseQSimulator, qubits: objects.ListObject) -> objects.IntObject:
+    # qubits[0] is the least significant bit.
+    return objects.IntObject(value=qsim.measure_all([obj.value for obj in qubits.value]))
+
+
+@register_builtin(pure=True)
+def __rhl_x(qsim: qsim.BaseQSimulator, qubit: objects.QubitObject) -> objects.NoneObject:
     qsim.x(qubit.value)
     return objects.NoneObject()
 
 
-@register_builtin()
-def __rhl_h(qsim: qsim.QSimulator, qubit: objects.QubitObject) -> objects.NoneObject:
+@register_builtin(pure=True)
+def __rhl_h(qsim: qsim.BaseQSimulator, qubit: objects.QubitObject) -> objects.NoneObject:
     qsim.h(qubit.value)
     return objects.NoneObject()
 
 
-@register_builtin()
-def __rhl_cx(qsim: qsim.QSimulator, control: objects.QubitObject, target: objects.QubitObject) -> objects.NoneObject:
+@register_builtin(pure=True)
+def __rhl_cx(qsim: qsim.BaseQSimulator, control: objects.QubitObject, target: objects.QubitObject) -> objects.NoneObject:
     qsim.cx(control.value, target.value)
     return objects.NoneObject()
 
 
+register_gate("z", qsim.Z)
+register_gate("s", qsim.S)
+register_gate("t", qsim.T)
+
+
+# Gates `apply_layer` accepts by name.
+LAYER_GATES = {"x": qsim.X, "h": qsim.H, "z": qsim.Z, "s": qsim.S, "t": qsim.T}
+
+
+def register_layer(name: str, op: np.ndarray) -> None:
+    @register_builtin(
+        name=name,
+        parameters=[("qubits", types.ListType.get_or_create(element_type=types.qubit_type))],
+        return_type=types.none_type,
+        pure=True,
+    )
+    def __rhl_layer(qsim: qsim.BaseQSimulator, qubits: objects.ListObject) -> objects.NoneObject:
+        qsim.apply_layer([op] * len(qubits.value), [obj.value for obj in qubits.value])
+        return objects.NoneObject()
+
+
+register_layer("x_all", qsim.X)
+register_layer("h_all", qsim.H)
+
+
 @register_builtin(
     parameters=[
         ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
-    ]
+        ("gates", types.ListType.get_or_create(element_type=types.str_type)),
+    ],
+    pure=True,
+)
+def __rhl_apply_layer(qsim: qsim.BaseQSimulator, qubits: objects.ListObject, gates: objects.ListObject) -> objects.NoneObject:
+    # gates[i] (one of LAYER_GATES) is applied to qubits[i].
+    for gate in gates.value:
+        if gate.value not in LAYER_GATES:
+            raise Exception(f"Unknown layer gate '{gate.value}'")
+    qsim.apply_layer(
+        [LAYER_GATES[gate.value] for gate in gates.value],
+        [obj.value for obj in qubits.value],
+    )
+    return objects.NoneObject()
+
+
+@register_builtin(
+    parameters=[
+        ("qubit", types.qubit_type),
+        ("theta", types.ratio_type),
+    ],
+    pure=True,
+)
+def __rhl_rz(qsim: qsim.BaseQSimulator, qubit: objects.QubitObject, theta: objects.RationalObject) -> objects.NoneObject:
+    qsim.apply(rz_matrix(theta.value), qubit.value)
+    return objects.NoneObject()
+
+
+@register_builtin(
+    parameters=[
+        ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
+    ],
+    pure=True,
 )
-def __rhl_mcz(qsim: qsim.QSimulator, qubits: objects.ListObject) -> objects.NoneObject:
+def __rhl_mcz(qsim: qsim.BaseQSimulator, qubits: objects.ListObject) -> objects.NoneObject:
     qsim.mcz([obj.value for obj in qubits.value])
     return objects.NoneObject()
+
+
+@register_builtin(
+    parameters=[
+        ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
+        ("theta", types.ratio_type),
+    ],
+    pure=True,
+)
+def __rhl_mcphase(qsim: qsim.BaseQSimulator, qubits: objects.ListObject, theta: objects.RationalObject) -> objects.NoneObject:
+    qsim.mcphase([obj.value for obj in qubits.value], complex(np.exp(1j * theta.value)))
+    return objects.NoneObject()
+
+
+@register_builtin(
+    parameters=[
+        ("control", types.qubit_type),
+        ("target", types.qubit_type),
+        ("theta", types.ratio_type),
+    ],
+    pure=True,
+)
+def __rhl_cp(qsim: qsim.BaseQSimulator, control: objects.QubitObject, target: objects.QubitObject, theta: objects.RationalObject) -> objects.NoneObject:
+    qsim.apply_diagonal([1, 1, 1, np.exp(1j * theta.value)], [control.value, target.value])
+    return objects.NoneObject()
+
+
+@register_builtin(
+    parameters=[
+        ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
+        ("angles", types.ListType.get_or_create(element_type=types.ratio_type)),
+    ],
+    pure=True,
+)
+def __rhl_diagonal(qsim: qsim.BaseQSimulator, qubits: objects.ListObject, angles: objects.ListObject) -> objects.NoneObject:
+    # angles[i] is the phase of the basis state whose j-th bit is qubits[j].
+    diagonal = np.exp(1j * np.array([float(obj.value) for obj in angles.value]))
+    qsim.apply_diagonal(diagonal, [obj.value for obj in qubits.value])
+    return objects.NoneObject()
+
+
+@register_builtin(
+    parameters=[
+        ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
+    ],
+    return_type=types.ListType.get_or_create(element_type=types.ratio_type),
+)
+def __rhl_probabilities(qsim: qsim.BaseQSimulator, qubits: objects.ListObject) -> objects.ListObject:
+    # Element i is the probability of measuring i, with qubits[0] as the
+    # least significant bit, computed without collapsing the state.
+    probabilities = qsim.probabilities([obj.value for obj in qubits.value])
+    return objects.ListObject(
+        value=[objects.RationalObject(value=float(p)) for p in probabilities],
+        element_type=types.ratio_type,
+    )
+
+
+@register_builtin(
+    parameters=[
+        ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
+        ("outcome", types.int_type),
+    ],
+    return_type=types.ratio_type,
+)
+def __rhl_probability(qsim: qsim.BaseQSimulator, qubits: objects.ListObject, outcome: objects.IntObject) -> objects.RationalObject:
+    probabilities = qsim.probabilities([obj.value for obj in qubits.value])
+    if not 0 <= outcome.value < len(probabilities):
+        raise Exception(f"Outcome {outcome.value} out of range for {len(qubits.value)} qubits")
+    return objects.RationalObject(value=float(probabilities[outcome.value]))
+
+
+@register_builtin(
+    parameters=[
+        ("qubits", types.ListType.get_or_create(element_type=types.qubit_type)),
+        ("shots", types.int_type),
+    ],
+    return_type=types.ListType.get_or_create(element_type=types.int_type),
+)
+def __rhl_sample(qsim: qsim.BaseQSimulator, qubits: objects.ListObject, shots: objects.IntObject) -> objects.ListObject:
+    outcomes = qsim.sample([obj.value for obj in qubits.value], shots.value)
+    return objects.ListObject(
+        value=[objects.IntObject(value=v) for v in outcomes],
+        element_type=types.int_type,
+    )
+
+
+def _get_snapshot(qsim: qsim.BaseQSimulator, handle: objects.IntObject) -> Any:
+    if not 0 <= handle.value < len(qsim.snapshots) or qsim.snapshots[handle.value] is None:
+        raise Exception(f"Invalid snapshot handle {handle.value}")
+    return qsim.snapshots[handle.value]
+
+
+@register_builtin()
+def __rhl_snapshot(qsim: qsim.BaseQSimulator) -> objects.IntObject:
+    # Handles are only valid until the end of the shot.
+    qsim.snapshots.append(qsim.snapshot())
+    return objects.IntObject(value=len(qsim.snapshots) - 1)
+
+
+@register_builtin()
+def __rhl_restore(qsim: qsim.BaseQSimulator, handle: objects.IntObject) -> objects.NoneObject:
+    qsim.restore(_get_snapshot(qsim, handle))
+    return objects.NoneObject()
+
+
+@register_builtin()
+def __rhl_release(qsim: qsim.BaseQSimulator, handle: objects.IntObject) -> objects.NoneObject:
+    # Frees the state kept for the snapshot.
+    qsim.release(_get_snapshot(qsim, handle))
+    qsim.snapshots[handle.value] = None
+    return objects.NoneObject()
@@ -0,0 +1,141 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from . import qsim
+
+
+# How many gates back a new gate looks for one to cancel or merge with.
+PEEPHOLE_WINDOW = 64
+
+
+@dataclass(frozen=True)
+class Gate:
+    # One of "apply" (qubits are the target, then the controls), "mcz",
+    # "mcphase" (matrix holds the phase), "diagonal" (matrix holds the
+    # entries), "unitary" or "layer" (matrix stacks one 2x2 operator per
+    # qubit).
+    kind: str
+    qubits: tuple[int, ...]
+    matrix: np.ndarray | None = None
+
+    def is_diagonal(self) -> bool:
+        match self.kind:
+            case "mcz" | "mcphase" | "diagonal":
+                return True
+            case "layer":
+                return not self.matrix[:, [0, 1], [1, 0]].any()
+            case _:
+                return not (self.matrix - np.diag(np.diag(self.matrix))).any()
+
+
+def execute(
+    circuit: list[Gate],
+    simulator: qsim.BaseQSimulator,
+    local: dict[int, int] | None = None,
+) -> None:
+    # Applies the gates, renaming qubit q to local[q] if given.
+    for gate in circuit:
+        qubits = list(gate.qubits)
+        if local is not None:
+            qubits = [local[qubit] for qubit in qubits]
+        match gate.kind:
+            case "apply":
+                simulator.apply(gate.matrix, qubits[0], qubits[1:])
+            case "mcz":
+                simulator.mcz(qubits)
+            case "mcphase":
+                simulator.mcphase(qubits, complex(gate.matrix))
+            case "diagonal":
+                simulator.apply_diagonal(gate.matrix, qubits)
+            case "unitary":
+                simulator.apply_unitary(gate.matrix, qubits)
+            case "layer":
+                simulator.apply_layer(list(gate.matrix), qubits)
+
+
+def optimize(circuit: list[Gate]) -> list[Gate]:
+    # Peephole pass: each gate is merged into (or cancels) an earlier gate
+    # of the same shape if it commutes with everything in between, i.e. the
+    # gates between them don't share a qubit with it or are all diagonal.
+    # Runs of single-qubit gates are then regrouped into layers.
+    optimized: list[Gate] = []
+    for gate in circuit:
+        start = max(len(optimized) - PEEPHOLE_WINDOW, 0)
+        for i in reversed(range(start, len(optimized))):
+            other = optimized[i]
+            if (merged := _merge(other, gate)) is not None:
+                optimized[i : i + 1] = merged
+                break
+            if set(other.qubits) & set(gate.qubits) and not (
+                other.is_diagonal() and gate.is_diagonal()
+            ):
+                optimized.append(gate)
+                break
+        else:
+            optimized.append(gate)
+    return _group_layers(optimized)
+
+
+def _merge(first: Gate, second: Gate) -> list[Gate] | None:
+    # The gates replacing `first` followed by `second`, if they combine.
+    if first.kind != second.kind:
+        return None
+
+    match first.kind:
+        case "apply":
+            same_target = first.qubits[0] == second.qubits[0]
+            if not same_target or set(first.qubits) != set(second.qubits):
+                return None
+            matrix = second.matrix @ first.matrix
+            identity = np.allclose(matrix, qsim.IDENTITY)
+        case "mcz":
+            if set(first.qubits) != set(second.qubits):
+                return None
+            return []
+        case "mcphase":
+            if set(first.qubits) != set(second.qubits):
+                return None
+            matrix = second.matrix * first.matrix
+            identity = np.isclose(matrix, 1)
+        case "diagonal":
+            if first.qubits != second.qubits:
+                return None
+            matrix = second.matrix * first.matrix
+            identity = np.allclose(matrix, 1)
+        case "unitary":
+            if first.qubits != second.qubits:
+                return None
+            matrix = second.matrix @ first.matrix
+            identity = np.allclose(matrix, np.eye(len(matrix)))
+        case _:
+            return None
+
+    return [] if identity else [Gate(first.kind, first.qubits, matrix)]
+
+
+def _group_layers(circuit: list[Gate]) -> list[Gate]:
+    grouped: list[Gate] = []
+    for gate in circuit:
+        previous = grouped[-1] if grouped else None
+        if (
+            _is_single(gate)
+            and previous is not None
+            and (previous.kind == "layer" or _is_single(previous))
+            and gate.qubits[0] not in previous.qubits
+        ):
+            ops = previous.matrix
+            if previous.kind != "layer":
+                ops = ops[np.newaxis]
+            grouped[-1] = Gate(
+                "layer",
+                previous.qubits + gate.qubits,
+                np.concatenate([ops, gate.matrix[np.newaxis]]),
+            )
+        else:
+            grouped.append(gate)
+    return grouped
+
+
+def _is_single(gate: Gate) -> bool:
+    return gate.kind == "apply" and len(gate.qubits) == 1
@@ -33,5 +33,9 @@ class Environment:
         return "\n".join([str(d) for d in self._stack])
 
 
+def set_qsim(simulator: qsim.BaseQSimulator) -> None:
+    GLOBAL_ENV.declare("qsim", simulator)
+
+
 GLOBAL_ENV = Environment()
-GLOBAL_ENV.declare("qsim", qsim.QSimulator())
+set_qsim(qsim.QSimulator())
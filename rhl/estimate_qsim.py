@@ -0,0 +1,139 @@
+from collections import Counter
+from typing import Any
+
+import numpy as np
+
+from . import interpreter, qsim
+
+
+OUTCOME_POLICIES = ["random", "zero", "one"]
+
+# Single-qubit gates reported by name; any other operator is counted as "u".
+GATE_NAMES = [(qsim.X, "x"), (qsim.H, "h"), (qsim.Z, "z"), (qsim.S, "s"), (qsim.T, "t")]
+
+
+def _gate_name(op: np.ndarray, controls: int) -> str:
+    name = next((name for gate, name in GATE_NAMES if np.array_equal(op, gate)), "u")
+    return "c" * controls + name
+
+
+class EstimatingQSimulator(qsim.BaseQSimulator):
+    # Keeps no amplitudes, only counts what a program does to its qubits:
+    # gates by name, measurements, peak live qubits and circuit depth (the
+    # longest chain of operations sharing a qubit), in total and for each
+    # function on the interpreter's call stack. Measurements return outcomes
+    # from `outcomes` instead of sampling a state, so every operation costs
+    # the same regardless of the register size.
+    def __init__(
+        self,
+        num_qubits: int = qsim.BaseQSimulator.NUM_QUBITS,
+        outcomes: str = "random",
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable=True, seed=seed)
+        if outcomes not in OUTCOME_POLICIES:
+            raise Exception(f"Unknown outcome policy '{outcomes}'")
+        self.outcomes = outcomes
+
+        self.gates: Counter[str] = Counter()
+        self.measurements = 0
+        self.peak_qubits = 0
+        self.function_gates: Counter[str] = Counter()
+        self.function_measurements: Counter[str] = Counter()
+        # Per qubit, the number of operations before its next free slot.
+        self._depths: dict[int, int] = {}
+
+    @property
+    def depth(self) -> int:
+        return max(self._depths.values(), default=0)
+
+    def _grow_state(self, count: int) -> None:
+        pass
+
+    def qalloc(self, length: int) -> list[int]:
+        allocated = super().qalloc(length)
+        self.peak_qubits = max(self.peak_qubits, self.num_qubits - len(self.free_qubits))
+        return allocated
+
+    def _reset(self, qubit: int, outcome: int | None = None) -> int:
+        # Freshly allocated qubits are |0> by definition here.
+        return 0
+
+    def snapshot(self) -> Any:
+        return list(self.free_qubits), self.num_qubits, dict(self._depths)
+
+    def restore(self, snapshot: Any) -> None:
+        # The counts keep growing: work done after a snapshot still ran.
+        free_qubits, self.num_qubits, depths = snapshot
+        self.free_qubits = list(free_qubits)
+        self._depths = dict(depths)
+
+    def measure(self, qubit: int) -> int:
+        self._count(None, [qubit])
+        return self._outcome(1)
+
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        return [self._outcome(2 ** len(qubits) - 1) for _ in range(shots)]
+
+    def mcz(self, qubits: list[int]) -> None:
+        if qubits:
+            self._count("c" * (len(qubits) - 1) + "z", qubits)
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        if qubits:
+            self._count("c" * (len(qubits) - 1) + "p", qubits)
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        self._count(f"diagonal{len(qubits)}", qubits)
+
+    def _apply_unitary(self, unitary: np.ndarray, qubits: list[int]) -> None:
+        self._count(f"unitary{len(qubits)}", qubits)
+
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        self._count(_gate_name(op, len(controls)), [target, *controls])
+
+    def _count(self, gate: str | None, qubits: list[int]) -> None:
+        # `gate` is None for a measurement. A function that recurses is only
+        # charged once per operation.
+        functions = set(interpreter.CALL_STACK)
+        if gate is None:
+            self.measurements += 1
+            self.function_measurements.update(functions)
+        else:
+            self.gates[gate] += 1
+            self.function_gates.update(functions)
+
+        layer = max(self._depths.get(qubit, 0) for qubit in qubits) + 1
+        for qubit in qubits:
+            self._depths[qubit] = layer
+
+    def _outcome(self, ones: int) -> int:
+        # `ones` is the outcome with every measured bit set.
+        match self.outcomes:
+            case "zero":
+                return 0
+            case "one":
+                return ones
+            case _:
+                return int(self.rng.integers(ones + 1))
+
+    def report(self) -> str:
+        lines = [
+            f"Peak qubits: {self.peak_qubits}",
+            f"Depth: {self.depth}",
+            f"Measurements: {self.measurements}",
+            f"Gates: {self.gates.total()}",
+        ]
+        lines += [f"  {gate}: {count}" for gate, count in sorted(self.gates.items())]
+        functions = sorted(set(self.function_gates) | set(self.function_measurements))
+        if functions:
+            lines.append("Per function (including callees):")
+            lines += [
+                f"  {function}: {self.function_gates[function]} gates, "
+                f"{self.function_measurements[function]} measurements"
+                for function in functions
+            ]
+        return "\n".join(lines)
+
+    def to_string(self) -> str:
+        return "EstimatingQSimulator"
@@ -0,0 +1,170 @@
+import numpy as np
+
+from . import qsim
+
+
+class Cluster:
+    # A group of qubits that may be entangled with each other but not with
+    # anything else. Bit i of an index into `state` is qubits[i].
+    def __init__(self, qubits: list[int], state: np.ndarray):
+        self.qubits = qubits
+        self.state = state
+
+    def tensor(self) -> np.ndarray:
+        return self.state.reshape((2,) * len(self.qubits))
+
+    def axis(self, qubit: int) -> int:
+        return len(self.qubits) - 1 - self.qubits.index(qubit)
+
+
+class FactorizedQSimulator(qsim.BaseQSimulator):
+    # Keeps the register as a product of per-cluster state vectors. Clusters
+    # are merged when a gate spans several of them, and a measured qubit is
+    # split off into its own cluster again, so the cost of a gate depends on
+    # the size of its cluster rather than on the whole register.
+    SUPPORTS_UNITARIES = True
+
+    def __init__(
+        self,
+        num_qubits: int = qsim.BaseQSimulator.NUM_QUBITS,
+        growable: bool = False,
+        dtype: type[np.complexfloating] = np.complex128,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable, seed)
+        self.dtype = np.dtype(dtype)
+        self.clusters: dict[int, Cluster] = {}
+        for qubit in range(self.num_qubits):
+            self._set_basis_state(qubit, 0)
+
+    def _grow_state(self, count: int) -> None:
+        for qubit in range(self.num_qubits, self.num_qubits + count):
+            self._set_basis_state(qubit, 0)
+
+    def measure(self, qubit: int) -> int:
+        cluster = self.clusters[qubit]
+        prob_zeros = qsim.norm_squared(qsim.half(cluster.tensor(), cluster.axis(qubit), 0))
+
+        outcome = 0 if self._random() < prob_zeros else 1
+        self._collapse(qubit, outcome, prob_zeros if outcome == 0 else 1 - prob_zeros)
+        return outcome
+
+    def _collapse(self, qubit: int, outcome: int, probability: float | None = None) -> None:
+        cluster = self.clusters[qubit]
+        kept = qsim.half(cluster.tensor(), cluster.axis(qubit), outcome)
+        if probability is None:
+            probability = qsim.norm_squared(kept)
+        scale = qsim.collapse_scale(probability)
+
+        # The collapsed state is |outcome> on the measured qubit times the
+        # kept half on the rest of the cluster.
+        if len(cluster.qubits) > 1:
+            rest = kept.reshape(-1) * scale
+            rest_cluster = Cluster([q for q in cluster.qubits if q != qubit], rest)
+            for rest_qubit in rest_cluster.qubits:
+                self.clusters[rest_qubit] = rest_cluster
+        self._set_basis_state(qubit, outcome)
+
+    def _reset(self, qubit: int, outcome: int | None = None) -> int:
+        if outcome is None:
+            outcome = self.measure(qubit)
+        else:
+            self._collapse(qubit, outcome)
+        self._set_basis_state(qubit, 0)
+        return outcome
+
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        # Clusters are independent, so sampling each one separately samples
+        # the joint distribution.
+        outcomes = np.zeros(shots, dtype=np.int64)
+        for cluster in self._clusters_of(qubits):
+            probabilities = np.abs(cluster.state) ** 2
+            indices = self.rng.choice(
+                len(probabilities), size=shots, p=probabilities / probabilities.sum()
+            )
+            for i, qubit in enumerate(qubits):
+                if self.clusters[qubit] is cluster:
+                    outcomes |= ((indices >> cluster.qubits.index(qubit)) & 1) << i
+        return outcomes.tolist()
+
+    def probabilities(self, qubits: list[int]) -> np.ndarray:
+        # Each cluster contributes the bits of its own qubits independently.
+        outcomes = np.arange(2 ** len(qubits))
+        probabilities = np.ones(len(outcomes))
+        for cluster in self._clusters_of(qubits):
+            indices = np.arange(len(cluster.state))
+            cluster_outcomes = np.zeros(len(indices), dtype=np.int64)
+            mask = 0
+            for i, qubit in enumerate(qubits):
+                if self.clusters[qubit] is cluster:
+                    cluster_outcomes |= ((indices >> cluster.qubits.index(qubit)) & 1) << i
+                    mask |= 1 << i
+            marginal = np.bincount(
+                cluster_outcomes, weights=np.abs(cluster.state) ** 2, minlength=len(outcomes)
+            )
+            probabilities *= marginal[outcomes & mask]
+        return probabilities / probabilities.sum()
+
+    def mcz(self, qubits: list[int]) -> None:
+        if not qubits:
+            return
+        cluster = self._merge(qubits)
+        qsim.negate_all_ones(cluster.tensor(), [cluster.axis(qubit) for qubit in qubits])
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        if not qubits:
+            return
+        cluster = self._merge(qubits)
+        qsim.phase_all_ones(
+            cluster.tensor(), [cluster.axis(qubit) for qubit in qubits], phase
+        )
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        if not qubits:
+            return
+        cluster = self._merge(qubits)
+        axes = tuple(cluster.axis(qubit) for qubit in qubits)
+        cluster.tensor()[...] *= qsim.diagonal_mask(len(cluster.qubits), axes, diagonal)
+
+    def _apply_unitary(self, unitary: np.ndarray, qubits: list[int]) -> None:
+        if not qubits:
+            return
+        cluster = self._merge(qubits)
+        qsim.apply_unitary(
+            cluster.tensor(),
+            unitary.astype(self.dtype, copy=False),
+            [cluster.axis(qubit) for qubit in qubits],
+        )
+
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        cluster = self._merge([target, *controls])
+        qsim.apply_controlled(
+            cluster.tensor(),
+            op.astype(self.dtype, copy=False),
+            cluster.axis(target),
+            [cluster.axis(control) for control in controls],
+        )
+
+    def _merge(self, qubits: list[int]) -> Cluster:
+        clusters = self._clusters_of(qubits)
+        merged = clusters[0]
+        for cluster in clusters[1:]:
+            # Appending the qubits as high-order bits matches kron(new, old).
+            merged = Cluster(
+                merged.qubits + cluster.qubits, np.kron(cluster.state, merged.state)
+            )
+        for qubit in merged.qubits:
+            self.clusters[qubit] = merged
+        return merged
+
+    def _clusters_of(self, qubits: list[int]) -> list[Cluster]:
+        clusters = {id(self.clusters[qubit]): self.clusters[qubit] for qubit in qubits}
+        return list(clusters.values())
+
+    def _set_basis_state(self, qubit: int, bit: int) -> None:
+        state = np.zeros(2, dtype=self.dtype)
+        state[bit] = 1
+        self.clusters[qubit] = Cluster([qubit], state)
+
+    def to_string(self) -> str:
+        return "FactorizedQSimulator"
@@ -1,9 +1,15 @@
 from functools import singledispatchmethod
 from typing import NoReturn, cast
-from . import objects, exceptions, types, node
+import numpy as np
+from . import objects, exceptions, types, node, unitaries
 from .environment import Environment, GLOBAL_ENV
 
 
+# Names of the RHL functions being executed, innermost last, so simulators
+# can attribute work to them.
+CALL_STACK: list[str] = []
+
+
 class Interpreter:
     class Return(Exception):
         def __init__(self, value: objects.Object):
@@ -16,11 +22,19 @@ class Interpreter:
             self.environment = Environment(GLOBAL_ENV)
             self.environment.push()
 
-    def _is_truthy(self, object: objects.Object):
+    def _is_truthy(self, object: objects.Object, node: node.Node):
         if isinstance(object, objects.NoneObject):
             return False
 
         if isinstance(object, objects.BooleanObject):
+            if isinstance(object.value, np.ndarray):
+                # Batched runs hold one value per shot and can only branch
+                # when all the shots agree.
+                if object.value.all():
+                    return True
+                if not object.value.any():
+                    return False
+                self._raise_exception("cannot branch on a condition that differs between shots", node)
             return object.value
 
         # TODO: "" should be false or true?
@@ -46,6 +60,7 @@ class Interpreter:
             func_type=node.func_type,
             closure=Environment(self.environment),
             execute=lambda env: Interpreter(env).execute(node.get("body")),
+            declaration=node,
         )
         self.environment.declare(node.get("name").text, func)
 
@@ -55,13 +70,13 @@ class Interpreter:
 
     def _execute_if(self, node: node.Node) -> None:
         condition = self.evaluate(node.get("condition"))
-        if self._is_truthy(condition):
+        if self._is_truthy(condition, node.get("condition")):
             self.execute(node.get("body"))
         elif (else_body := node.get_or_none("else_body")) is not None:
             self.execute(else_body)
 
     def _execute_while(self, node: node.Node) -> None:
-        while self._is_truthy(self.evaluate(node.get("condition"))):
+        while self._is_truthy(self.evaluate(node.get("condition")), node.get("condition")):
             self.execute(node.get("body"))
 
     def _execute_return(self, node: node.Node) -> None:
@@ -98,16 +113,30 @@ class Interpreter:
     def _evaluate_call(self, node: node.Node) -> objects.Object:
         func = self.evaluate(node.get("function"))
         func = cast(objects.FunctionObject, func)
+        arguments = [self.evaluate(arg) for arg in node.get_all("argument")]
+
+        if func.declaration is not None and func.declaration.pure:
+            unitaries.call(func.declaration, arguments, lambda: self._call(func, arguments))
+            return objects.NoneObject()
+        return self._call(func, arguments)
 
+    def _call(
+        self, func: objects.FunctionObject, arguments: list[objects.Object]
+    ) -> objects.Object:
         env = Environment(func.closure)
         env.push()
-        for param, arg in zip(func.parameters, node.get_all("argument")):
-            env.declare(param, self.evaluate(arg))
+        for param, arg in zip(func.parameters, arguments):
+            env.declare(param, arg)
 
+        if func.declaration is not None:
+            CALL_STACK.append(func.name)
         try:
             func.execute(env)
         except self.Return as ex:
             return ex.value
+        finally:
+            if func.declaration is not None:
+                CALL_STACK.pop()
 
         return objects.NoneObject()
 
@@ -131,6 +160,8 @@ class Interpreter:
         match operator:
             case "!":
                 if isinstance(right, objects.BooleanObject):
+                    if isinstance(right.value, np.ndarray):
+                        return objects.BooleanObject(value=~right.value)
                     return objects.BooleanObject(value=not right.value)
 
             case "-":
@@ -149,12 +180,12 @@ class Interpreter:
 
         match operator:
             case "and":
-                if not self._is_truthy(left := self.evaluate(node.get("left"))):
+                if not self._is_truthy(left := self.evaluate(node.get("left")), node.get("left")):
                     return left
                 return self.evaluate(node.get("right"))
 
             case "or":
-                if self._is_truthy(left := self.evaluate(node.get("left"))):
+                if self._is_truthy(left := self.evaluate(node.get("left")), node.get("left")):
                     return left
                 return self.evaluate(node.get("right"))
 
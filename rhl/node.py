@@ -23,6 +23,9 @@ class Node:
 
         self._scope_distance: int | None = None
         self._func_type: types.FunctionType | None = None
+        # Set by the resolver on function declarations whose calls only apply
+        # gates to their qubit arguments.
+        self.pure = False
 
         self._report_errors()
 
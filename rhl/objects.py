@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Callable, ClassVar
 from dataclasses import dataclass
+import numpy as np
 
 from . import types
 
@@ -23,6 +24,8 @@ class IntObject(Object):
         return RationalObject(value=float(self.value))
 
     def to_string(self):
+        if isinstance(self.value, np.ndarray):
+            return " ".join(str(v) for v in self.value.tolist())
         return str(self.value)
 
 
@@ -50,6 +53,8 @@ class BooleanObject(Object):
     type: ClassVar[types.Type] = types.bool_type
 
     def to_string(self):
+        if isinstance(self.value, np.ndarray):
+            return " ".join("true" if v else "false" for v in self.value.tolist())
         return "true" if self.value else "false"
 
 
@@ -77,6 +82,7 @@ class FunctionObject(Object):
 
     closure: "environment.Environment"
     execute: Callable[["environment.Environment"], None]
+    declaration: "node.Node | None" = None
 
     @property
     def type(self):
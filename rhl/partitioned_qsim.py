@@ -0,0 +1,321 @@
+import mmap
+import multiprocessing
+from multiprocessing.connection import Connection
+import weakref
+import numpy as np
+
+from . import qsim
+
+
+class Partition:
+    # The worker side: owns one slice of the state vector, but can reach the
+    # others (they all live in memory shared between the processes) for
+    # swaps.
+    def __init__(self, tensors: list[np.ndarray], index: int):
+        self.tensors = tensors
+        self.tensor = tensors[index]
+        self.index = index
+
+    def apply(self, op: np.ndarray, axis: int, control_axes: list[int]) -> None:
+        qsim.apply_controlled(self.tensor, op, axis, control_axes)
+
+    def negate(self, axes: list[int]) -> None:
+        qsim.negate_all_ones(self.tensor, axes)
+
+    def phase(self, axes: list[int], phase: complex) -> None:
+        qsim.phase_all_ones(self.tensor, axes, phase)
+
+    def multiply(self, mask: np.ndarray) -> None:
+        self.tensor *= mask
+
+    def unitary(self, unitary: np.ndarray, axes: list[int]) -> None:
+        qsim.apply_unitary(self.tensor, unitary, axes)
+
+    def norm(self, axis: int | None, bit: int) -> float:
+        if axis is None:
+            return qsim.norm_squared(self.tensor)
+        return qsim.norm_squared(qsim.half(self.tensor, axis, bit))
+
+    def collapse(self, axis: int | None, outcome: int, scale: float) -> None:
+        if axis is None:
+            self.tensor *= scale
+            return
+        qsim.half(self.tensor, axis, 1 - outcome)[...] = 0
+        kept = qsim.half(self.tensor, axis, outcome)
+        kept *= scale
+
+    def marginal(self, axes: list[int]) -> np.ndarray:
+        # Distribution of the local bits, with axes[i] as bit i.
+        others = tuple(axis for axis in range(self.tensor.ndim) if axis not in axes)
+        marginal = (np.abs(self.tensor) ** 2).sum(axis=others)
+        kept = sorted(axes)
+        marginal = marginal.transpose([kept.index(axis) for axis in reversed(axes)])
+        return marginal.reshape(-1)
+
+    def swap(self, partner: int, axis: int) -> None:
+        # Exchanges the amplitudes where the global bit (0 here, 1 in the
+        # partner) and the local bit on `axis` differ.
+        ours = qsim.half(self.tensor, axis, 1)
+        theirs = qsim.half(self.tensors[partner], axis, 0)
+        kept = ours.copy()
+        ours[...] = theirs
+        theirs[...] = kept
+
+    def reset(self) -> None:
+        self.tensor[...] = 0
+        if self.index == 0:
+            self.tensor.flat[0] = 1
+
+
+def _serve(connection: Connection, tensors: list[np.ndarray], index: int) -> None:
+    partition = Partition(tensors, index)
+    while (message := connection.recv()) is not None:
+        command, args = message
+        connection.send(getattr(partition, command)(*args))
+
+
+def _shutdown(
+    connections: list[Connection], processes: list[multiprocessing.Process]
+) -> None:
+    for connection in connections:
+        connection.send(None)
+    for process in processes:
+        process.join()
+
+
+class PartitionedQSimulator(qsim.BaseQSimulator):
+    # Splits the state vector between `partitions` worker processes by its
+    # high-order (global) bits. Gates on local bits run in every partition
+    # at once; a gate whose target is global first swaps it with a local
+    # bit, which exchanges half of each partition with its partner. Logical
+    # qubits are mapped to physical bits to keep track of these swaps.
+    SUPPORTS_UNITARIES = True
+
+    def __init__(
+        self,
+        num_qubits: int = qsim.BaseQSimulator.NUM_QUBITS,
+        growable: bool = False,
+        partitions: int = 2,
+        dtype: type[np.complexfloating] = np.complex128,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable, seed)
+        if partitions < 1 or partitions & (partitions - 1):
+            raise Exception("The number of partitions must be a power of two")
+        self.global_bits = partitions.bit_length() - 1
+        # Gates need at least one local bit to swap a global target into.
+        if self.global_bits >= self.num_qubits:
+            raise Exception(
+                f"Cannot split {self.num_qubits} qubits into {partitions} partitions"
+            )
+        self.local_bits = self.num_qubits - self.global_bits
+        self.dtype = np.dtype(dtype)
+
+        # Anonymous shared mappings stay shared with the forked workers.
+        size = 2**self.local_bits * self.dtype.itemsize
+        self._buffers = [mmap.mmap(-1, size) for _ in range(partitions)]
+        tensors = [
+            np.frombuffer(buffer, dtype=self.dtype).reshape((2,) * self.local_bits)
+            for buffer in self._buffers
+        ]
+        tensors[0].flat[0] = 1
+
+        context = multiprocessing.get_context("fork")
+        self._connections: list[Connection] = []
+        processes = []
+        for index in range(partitions):
+            ours, theirs = context.Pipe()
+            process = context.Process(
+                target=_serve, args=(theirs, tensors, index), daemon=True
+            )
+            process.start()
+            self._connections.append(ours)
+            processes.append(process)
+        weakref.finalize(self, _shutdown, self._connections, processes)
+
+        self._physical = list(range(self.num_qubits))
+
+    def _grow_state(self, count: int) -> None:
+        raise Exception("PartitionedQSimulator cannot grow its register")
+
+    def new_shot(self) -> None:
+        super().new_shot()
+        self._physical = list(range(self.num_qubits))
+        self._run("reset")
+
+    def measure(self, qubit: int) -> int:
+        prob_zeros = self._probability(qubit, 0)
+        outcome = 0 if self._random() < prob_zeros else 1
+        self._collapse(qubit, outcome, prob_zeros if outcome == 0 else 1 - prob_zeros)
+        return outcome
+
+    def _probability(self, qubit: int, outcome: int) -> float:
+        axis, bit = self._location(qubit)
+        if axis is not None:
+            return sum(self._run("norm", axis, outcome))
+        norms = self._run("norm", None, 0)
+        return sum(
+            norm for index, norm in enumerate(norms) if self._bit(index, bit) == outcome
+        )
+
+    def _collapse(self, qubit: int, outcome: int, probability: float | None = None) -> None:
+        if probability is None:
+            probability = self._probability(qubit, outcome)
+        scale = qsim.collapse_scale(probability)
+        axis, bit = self._location(qubit)
+        if axis is not None:
+            self._run("collapse", axis, outcome, scale)
+        else:
+            self._run_each(
+                lambda index: (
+                    "collapse",
+                    (None, outcome, scale if self._bit(index, bit) == outcome else 0),
+                )
+            )
+
+    def probabilities(self, qubits: list[int]) -> np.ndarray:
+        locations = [self._location(qubit) for qubit in qubits]
+        local = [i for i, (axis, _) in enumerate(locations) if axis is not None]
+        marginals = self._run("marginal", [locations[i][0] for i in local])
+
+        # Scatter each partition's local distribution to the outcomes whose
+        # global bits match the partition.
+        local_outcomes = np.zeros(2 ** len(local), dtype=np.int64)
+        for j, i in enumerate(local):
+            local_outcomes |= ((np.arange(2 ** len(local)) >> j) & 1) << i
+        probabilities = np.zeros(2 ** len(qubits))
+        for index, marginal in enumerate(marginals):
+            offset = sum(
+                self._bit(index, bit) << i
+                for i, (axis, bit) in enumerate(locations)
+                if axis is None
+            )
+            probabilities[local_outcomes + offset] += marginal
+        return probabilities / probabilities.sum()
+
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        probabilities = self.probabilities(qubits)
+        return self.rng.choice(len(probabilities), size=shots, p=probabilities).tolist()
+
+    def mcz(self, qubits: list[int]) -> None:
+        # Diagonal, so global qubits only select the partitions it acts on.
+        locations = [self._location(qubit) for qubit in qubits]
+        axes = [axis for axis, _ in locations if axis is not None]
+        global_bits = [bit for axis, bit in locations if axis is None]
+        self._run_each(
+            lambda index: ("negate", (axes,))
+            if all(self._bit(index, bit) for bit in global_bits)
+            else None
+        )
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        locations = [self._location(qubit) for qubit in qubits]
+        axes = [axis for axis, _ in locations if axis is not None]
+        global_bits = [bit for axis, bit in locations if axis is None]
+        self._run_each(
+            lambda index: ("phase", (axes, phase))
+            if all(self._bit(index, bit) for bit in global_bits)
+            else None
+        )
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        locations = [self._location(qubit) for qubit in qubits]
+        axes = tuple(axis for axis, _ in locations if axis is not None)
+        entries = np.arange(len(diagonal))
+
+        def multiply(index: int) -> tuple[str, tuple]:
+            # The entries whose global bits match the partition, in the
+            # order of the remaining local bits.
+            matching = np.ones(len(diagonal), dtype=bool)
+            for i, (axis, bit) in enumerate(locations):
+                if axis is None:
+                    matching &= ((entries >> i) & 1) == self._bit(index, bit)
+            local = diagonal[matching]
+            return "multiply", (qsim.diagonal_mask(self.local_bits, axes, local),)
+
+        self._run_each(multiply)
+
+    def max_unitary_qubits(self) -> int:
+        # The operator's qubits all have to be local at once.
+        return self.local_bits
+
+    def _apply_unitary(self, unitary: np.ndarray, qubits: list[int]) -> None:
+        self._localize(qubits)
+        axes = [self._location(qubit)[0] for qubit in qubits]
+        self._run("unitary", unitary.astype(self.dtype, copy=False), axes)
+
+    def _apply(
+        self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()
+    ) -> None:
+        self._localize([target], avoid=controls)
+        axis, _ = self._location(target)
+        locations = [self._location(control) for control in controls]
+        control_axes = [axis for axis, _ in locations if axis is not None]
+        global_bits = [bit for axis, bit in locations if axis is None]
+        op = op.astype(self.dtype, copy=False)
+        self._run_each(
+            lambda index: ("apply", (op, axis, control_axes))
+            if all(self._bit(index, bit) for bit in global_bits)
+            else None
+        )
+
+    def _localize(self, qubits: list[int], avoid: tuple[int, ...] = ()) -> None:
+        # Swaps every global qubit in `qubits` with a local one that isn't
+        # involved in the gate. Controls work from global bits too, so they
+        # are swapped out when nothing else is left (e.g. a single local bit).
+        busy = {self._physical[qubit] for qubit in qubits}
+        controls = {self._physical[qubit] for qubit in avoid}
+        for qubit in qubits:
+            physical = self._physical[qubit]
+            if physical < self.local_bits:
+                continue
+
+            free = [bit for bit in range(self.local_bits) if bit not in busy]
+            free = [bit for bit in free if bit not in controls] or free
+            if not free:
+                raise Exception(
+                    f"Gate spans more than the {self.local_bits} local qubits"
+                )
+            self._swap(physical, free[-1])
+            busy.add(free[-1])
+
+    def _swap(self, physical: int, local: int) -> None:
+        bit = physical - self.local_bits
+        axis = self.local_bits - 1 - local
+        self._run_each(
+            lambda index: ("swap", (index | 1 << bit, axis))
+            if not self._bit(index, bit)
+            else None
+        )
+        for qubit, position in enumerate(self._physical):
+            if position == physical:
+                self._physical[qubit] = local
+            elif position == local:
+                self._physical[qubit] = physical
+
+    def _location(self, qubit: int) -> tuple[int | None, int]:
+        # Either the local axis of a qubit, or the partition index bit that
+        # holds it.
+        physical = self._physical[qubit]
+        if physical < self.local_bits:
+            return self.local_bits - 1 - physical, 0
+        return None, physical - self.local_bits
+
+    def _bit(self, index: int, bit: int) -> int:
+        return (index >> bit) & 1
+
+    def _run(self, command: str, *args) -> list:
+        return self._run_each(lambda _: (command, args))
+
+    def _run_each(self, message) -> list:
+        # Sends each worker its message (None to skip it), then waits for
+        # all of them, so the partitions are processed in parallel.
+        sent = []
+        for index, connection in enumerate(self._connections):
+            if (command := message(index)) is not None:
+                connection.send(command)
+                sent.append(connection)
+        return [connection.recv() for connection in sent]
+
+    def to_string(self) -> str:
+        return "PartitionedQSimulator"
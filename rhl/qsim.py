@@ -1,107 +1,809 @@
-from typing import Any
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import functools
+import os
+from typing import Any, Callable, Iterable
 import numpy as np
 
 from . import objects
 
 
+# Diagonal gates on more qubits than this don't keep their mask around.
+MAX_CACHED_MASK_QUBITS = 10
+
+IDENTITY = np.eye(2, dtype=complex)
+
 X = np.array([
     [0, 1],
     [1, 0]
-])
+], dtype=complex)
 
 H = 1 / np.sqrt(2) * np.array([
     [1, 1],
     [1, -1]
-])
+], dtype=complex)
+
+Z = np.array([
+    [1, 0],
+    [0, -1]
+], dtype=complex)
+
+S = np.array([
+    [1, 0],
+    [0, 1j]
+], dtype=complex)
+
+T = np.array([
+    [1, 0],
+    [0, np.exp(1j * np.pi / 4)]
+], dtype=complex)
+
+
+def rz_matrix(theta: float) -> np.ndarray:
+    return np.array([
+        [np.exp(-1j * theta / 2), 0],
+        [0, np.exp(1j * theta / 2)]
+    ], dtype=complex)
+
+
+def apply_matrix(tensor: np.ndarray, op: np.ndarray, axis: int) -> None:
+    # Applies a 2x2 operator in-place on one axis of a [2] * n shaped view,
+    # touching each amplitude once instead of building a 2^n x 2^n operator.
+    prefix = (slice(None),) * axis
+    zeros = tensor[prefix + (0, Ellipsis)]
+    ones = tensor[prefix + (1, Ellipsis)]
+
+    old_zeros = zeros.copy()
+    zeros *= op[0, 0]
+    zeros += op[0, 1] * ones
+    ones *= op[1, 1]
+    ones += op[1, 0] * old_zeros
+
+
+def half(tensor: np.ndarray, axis: int, bit: int) -> np.ndarray:
+    return tensor[(slice(None),) * axis + (bit, Ellipsis)]
+
+
+def split_tensor(tensor: np.ndarray, busy_axes: Iterable[int], count: int) -> list[np.ndarray]:
+    # Splits into at least `count` views by fixing the leading axes that the
+    # operation doesn't touch. Fixed axes keep a length of 1, so axis numbers
+    # stay valid inside each chunk.
+    busy_axes = set(busy_axes)
+    chunks = [tensor]
+    for axis in range(tensor.ndim):
+        if len(chunks) >= count:
+            break
+        if axis in busy_axes:
+            continue
+        prefix = (slice(None),) * axis
+        chunks = [chunk[prefix + (slice(bit, bit + 1),)] for chunk in chunks for bit in (0, 1)]
+    return chunks
+
+
+def collapse_scale(probability: float) -> float:
+    # What the kept amplitudes are multiplied by after a measurement. An
+    # outcome given to `collapse` may be one the state can't produce.
+    if probability < 1e-12:
+        raise Exception("Measurement outcome has probability zero")
+    return 1 / np.sqrt(probability)
+
+
+def norm_squared(view: np.ndarray) -> float:
+    # einsum reduces straight from the strided view, without materializing
+    # |view|^2 as a temporary. Axes are given as integers, since subscript
+    # letters would run out before the register does.
+    axes = list(range(view.ndim))
+    total = np.einsum(view.real, axes, view.real, axes, [])
+    if np.iscomplexobj(view):
+        total += np.einsum(view.imag, axes, view.imag, axes, [])
+    return float(total)
+
+
+def apply_controlled(
+    tensor: np.ndarray, op: np.ndarray, axis: int, control_axes: Iterable[int] = ()
+) -> None:
+    control_axes = list(control_axes)
+    index = [slice(None)] * tensor.ndim
+    for control_axis in control_axes:
+        index[control_axis] = 1
+
+    # Fixing the controls to 1 drops their axes from the view.
+    axis -= sum(1 for control_axis in control_axes if control_axis < axis)
+    apply_matrix(tensor[tuple(index)], op, axis)
+
+
+def apply_unitary(tensor: np.ndarray, unitary: np.ndarray, axes: list[int]) -> None:
+    # Applies a 2^k x 2^k operator whose index bit i is the bit on axes[i].
+    k = len(axes)
+    # Row and column bits of the reshaped operator run from bit k-1 down to 0.
+    tensor_axes = axes[::-1]
+    result = np.tensordot(
+        unitary.reshape((2,) * (2 * k)), tensor, axes=(list(range(k, 2 * k)), tensor_axes)
+    )
+    tensor[...] = np.moveaxis(result, list(range(k)), tensor_axes)
+
+
+def negate_all_ones(tensor: np.ndarray, axes: Iterable[int]) -> None:
+    phase_all_ones(tensor, axes, -1)
+
+
+def phase_all_ones(tensor: np.ndarray, axes: Iterable[int], phase: complex) -> None:
+    index = [slice(None)] * tensor.ndim
+    for axis in axes:
+        index[axis] = 1
+    tensor[tuple(index) + (Ellipsis,)] *= phase
+
+
+def diagonal_mask(ndim: int, axes: tuple[int, ...], diagonal: np.ndarray) -> np.ndarray:
+    # Lays out `diagonal` (bit i of its index is the bit on axes[i]) so it
+    # broadcasts against a [2] * ndim tensor. The mask only holds 2^k phases,
+    # so repeated gates on the same few qubits reuse it; larger diagonals
+    # would cost more to hash than to lay out again.
+    if len(axes) <= MAX_CACHED_MASK_QUBITS:
+        return _cached_diagonal_mask(ndim, axes, tuple(diagonal.tolist()))
+    return _diagonal_mask(ndim, axes, diagonal)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_diagonal_mask(
+    ndim: int, axes: tuple[int, ...], diagonal: tuple[complex, ...]
+) -> np.ndarray:
+    return _diagonal_mask(ndim, axes, diagonal)
+
+
+def _diagonal_mask(
+    ndim: int, axes: tuple[int, ...], diagonal: np.ndarray | tuple[complex, ...]
+) -> np.ndarray:
+    k = len(axes)
+    by_axis = sorted(range(k), key=lambda i: axes[i])
+    mask = np.array(diagonal).reshape((2,) * k).transpose([k - 1 - i for i in by_axis])
+    shape = [1] * ndim
+    for axis in axes:
+        shape[axis] = 2
+    mask = mask.reshape(shape)
+    mask.flags.writeable = False
+    return mask
+
 
+@dataclass(frozen=True)
+class Snapshot:
+    # The state vector is shared with the simulator, which copies it before
+    # writing to it again.
+    state_vector: np.ndarray
+    width: int
+    pending: dict[int, np.ndarray]
+    num_qubits: int
+    free_qubits: list[int]
 
-class QSimulator(objects.Object):
+
+class BaseQSimulator(objects.Object):
     NUM_QUBITS = 3
+    # Uniform randoms for measurements are drawn from the generator this many
+    # at a time.
+    RANDOM_BLOCK = 4096
+    # Whether apply_unitary is implemented, so calls to pure subroutines can
+    # be replaced by their cached operator.
+    SUPPORTS_UNITARIES = False
+
+    def __init__(
+        self,
+        num_qubits: int = NUM_QUBITS,
+        growable: bool = False,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        self.num_qubits = num_qubits
+        self.growable = growable
+        self.free_qubits = list(range(self.num_qubits))
+
+        self.rng = np.random.default_rng(seed)
+        self._randoms = np.empty(0)
+        self._next_random = 0
 
-    def __init__(self):
-        self.free_qubits = list(range(self.NUM_QUBITS))
-        self.state_vector = np.zeros(2 ** self.NUM_QUBITS)
-        self.state_vector[0] = 1
+        # Taken by the `snapshot` builtin, indexed by handle (None once
+        # released). They only live for the current shot.
+        self.snapshots: list[Any] = []
+        # Resets (on qalloc, and when a dense register traces out freed
+        # qubits) measure inside the simulator. A TraceRecorder collects their
+        # outcomes in `reset_log`, and replay forces them through
+        # `forced_resets`, by qubit.
+        self.reset_log: list[tuple[int, int]] | None = None
+        self.forced_resets: dict[int, int] = {}
 
     def qalloc(self, length: int) -> list[int]:
         if length > len(self.free_qubits):
-            raise Exception("Not enough qubits")
+            if not self.growable:
+                raise Exception("Not enough qubits")
+            self._grow(length - len(self.free_qubits))
 
         allocated, self.free_qubits = self.free_qubits[:length], self.free_qubits[length:]
         for qubit in allocated:
-            self._reset(qubit)
+            self._reset_qubit(qubit)
         return allocated
 
     def qfree(self, qubits: list[int]) -> None:
-        self.free_qubits += qubits
+        # Handing out the lowest free qubits first keeps short-lived
+        # registers at the top of the register.
+        self.free_qubits = sorted(self.free_qubits + qubits)
 
-    def _reset(self, qubit: int) -> None:
-        val = self.measure(qubit)
-        if val == 1:
-            self.x(qubit)
+    def measure_all(self, qubits: list[int]) -> int:
+        # Measures the integer whose i-th bit is qubits[i].
+        qubits = list(qubits)
+        if len(set(qubits)) != len(qubits):
+            raise Exception("Measured qubits must be distinct")
+        return self._measure_all(qubits)
 
-    def measure(self, qubit: int) -> int:
-        zeros, ones = self._divide_by(qubit)
-        prob_zeros = zeros.dot(zeros)
-        prob_ones = ones.dot(ones)
+    def _measure_all(self, qubits: list[int]) -> int:
+        outcome = 0
+        for i, qubit in enumerate(qubits):
+            outcome |= self.measure(qubit) << i
+        return outcome
 
-        rand_number = np.random.random()
-        if rand_number < prob_zeros:
-            self.state_vector = zeros / np.sqrt(prob_zeros)
-            return 0
+    def collapse(self, qubit: int, outcome: int) -> None:
+        # Measures `qubit` with a known outcome (e.g. one read from a trace)
+        # instead of sampling it.
+        if outcome not in (0, 1):
+            raise Exception(f"Invalid measurement outcome {outcome}")
+        self._collapse(qubit, outcome)
+
+    def _collapse(self, qubit: int, outcome: int) -> None:
+        raise Exception(f"{self.to_string()} does not support forced measurements")
+
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        raise Exception(f"{self.to_string()} does not support sampling")
+
+    def probabilities(self, qubits: list[int]) -> np.ndarray:
+        # The distribution of the integer whose i-th bit is qubits[i], without
+        # collapsing the state.
+        raise Exception(f"{self.to_string()} does not support probability queries")
+
+    def new_shot(self) -> None:
+        # Qubits are reset when allocated, so releasing them is enough to
+        # start over.
+        self.free_qubits = list(range(self.num_qubits))
+        self.snapshots = []
+
+    def snapshot(self) -> Any:
+        # A handle on the current state and allocator, which `restore` goes
+        # back to. Measurement randomness is not rewound.
+        raise Exception(f"{self.to_string()} does not support snapshots")
+
+    def restore(self, snapshot: Any) -> None:
+        raise Exception(f"{self.to_string()} does not support snapshots")
+
+    def release(self, snapshot: Any) -> None:
+        # Called when a snapshot won't be restored again, for wrappers that
+        # keep track of them.
+        pass
+
+    def _random(self) -> float:
+        if self._next_random == len(self._randoms):
+            self._randoms = self.rng.random(self.RANDOM_BLOCK)
+            self._next_random = 0
+        value = self._randoms[self._next_random]
+        self._next_random += 1
+        return float(value)
+
+    def _grow(self, count: int) -> None:
+        self._grow_state(count)
+        self.free_qubits += list(range(self.num_qubits, self.num_qubits + count))
+        self.num_qubits += count
+
+    def _reset_qubit(self, qubit: int) -> None:
+        outcome = self._reset(qubit, self.forced_resets.pop(qubit, None))
+        if self.reset_log is not None:
+            self.reset_log.append((qubit, outcome))
+
+    def _reset(self, qubit: int, outcome: int | None = None) -> int:
+        # Measures the qubit, or collapses it onto `outcome` if given, and
+        # returns it to |0>. Returns the outcome.
+        if outcome is None:
+            outcome = self.measure(qubit)
         else:
-            self.state_vector = ones / np.sqrt(prob_ones)
-            return 1
+            self.collapse(qubit, outcome)
+        if outcome == 1:
+            self.x(qubit)
+        return outcome
 
-    def _divide_by(self, qubit: int) -> Any:
-        zeros = np.zeros(2 ** self.NUM_QUBITS)
-        ones = np.zeros(2 ** self.NUM_QUBITS)
+    def apply(self, op: np.ndarray, target: int, controls: Iterable[int] = ()) -> None:
+        # Generic entry point for (multi-)controlled single-qubit unitaries.
+        op = np.asarray(op)
+        if op.shape != (2, 2):
+            raise Exception(f"Expected a 2x2 operator, got shape {op.shape}")
+        self._apply(op, target, tuple(controls))
 
-        for i in range(2 ** self.NUM_QUBITS):
-            if (i >> qubit) % 2 == 0:
-                zeros[i] = self.state_vector[i]
-            else:
-                ones[i] = self.state_vector[i]
+    def apply_diagonal(self, diagonal: np.ndarray, qubits: Iterable[int]) -> None:
+        # Generic entry point for phase-only gates: the amplitudes where
+        # qubits[j] holds bit j of i are multiplied by diagonal[i].
+        diagonal = np.asarray(diagonal)
+        qubits = list(qubits)
+        if diagonal.shape != (2 ** len(qubits),):
+            raise Exception(
+                f"Expected {2 ** len(qubits)} diagonal entries, got shape {diagonal.shape}"
+            )
+        if len(set(qubits)) != len(qubits):
+            raise Exception("Diagonal gate qubits must be distinct")
+        self._apply_diagonal(diagonal, qubits)
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        raise Exception(f"{self.to_string()} does not support diagonal gates")
+
+    def mcphase(self, qubits: Iterable[int], phase: complex) -> None:
+        # Multiplies the amplitudes where every qubit is 1 by `phase`.
+        qubits = list(qubits)
+        if len(set(qubits)) != len(qubits):
+            raise Exception("Phase gate qubits must be distinct")
+        self._mcphase(qubits, phase)
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        # Backends that can index the all-ones slice override this rather
+        # than building the 2^k diagonal.
+        diagonal = np.ones(2 ** len(qubits), dtype=complex)
+        diagonal[-1] = phase
+        self._apply_diagonal(diagonal, qubits)
+
+    def apply_unitary(self, unitary: np.ndarray, qubits: Iterable[int]) -> None:
+        # Applies a 2^k x 2^k operator, where bit j of its row and column
+        # indices is the value of qubits[j].
+        unitary = np.asarray(unitary)
+        qubits = list(qubits)
+        size = 2 ** len(qubits)
+        if unitary.shape != (size, size):
+            raise Exception(f"Expected a {size}x{size} operator, got shape {unitary.shape}")
+        if len(set(qubits)) != len(qubits):
+            raise Exception("Unitary qubits must be distinct")
+        self._apply_unitary(unitary, qubits)
+
+    def _apply_unitary(self, unitary: np.ndarray, qubits: list[int]) -> None:
+        raise Exception(f"{self.to_string()} does not support multi-qubit unitaries")
 
-        return zeros, ones
+    def max_unitary_qubits(self) -> int:
+        return self.num_qubits
+
+    def apply_layer(self, ops: Iterable[np.ndarray], qubits: Iterable[int]) -> None:
+        # Applies ops[i] to qubits[i] for every i, as one layer of
+        # single-qubit gates.
+        ops = [np.asarray(op) for op in ops]
+        qubits = list(qubits)
+        if len(ops) != len(qubits):
+            raise Exception(f"Expected {len(qubits)} operators, got {len(ops)}")
+        for op in ops:
+            if op.shape != (2, 2):
+                raise Exception(f"Expected a 2x2 operator, got shape {op.shape}")
+        if len(set(qubits)) != len(qubits):
+            raise Exception("Layer qubits must be distinct")
+        self._apply_layer(ops, qubits)
+
+    def _apply_layer(self, ops: list[np.ndarray], qubits: list[int]) -> None:
+        for op, qubit in zip(ops, qubits):
+            self._apply(op, qubit)
 
     def x(self, qubit: int) -> None:
-        op = self._kron_product(X, qubit)
-        self.state_vector = op @ self.state_vector
+        self._apply(X, qubit)
 
     def h(self, qubit: int) -> None:
-        op = self._kron_product(H, qubit)
-        self.state_vector = op @ self.state_vector
-
-    def _kron_product(self, op: np.array, qubit: int) -> np.array:
-        return np.kron(
-            np.eye(2 ** (self.NUM_QUBITS - qubit - 1)),
-            np.kron(
-                op,
-                np.eye(2 ** qubit)
+        self._apply(H, qubit)
+
+    def cx(self, control: int, target: int) -> None:
+        self._apply(X, target, (control,))
+
+    @abstractmethod
+    def _grow_state(self, count: int) -> None:
+        pass
+
+    @abstractmethod
+    def measure(self, qubit: int) -> int:
+        pass
+
+    @abstractmethod
+    def mcz(self, qubits: list[int]) -> None:
+        pass
+
+    @abstractmethod
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        pass
+
+
+class QSimulator(BaseQSimulator):
+    # Below this size thread dispatch costs more than it saves.
+    PARALLEL_MIN_QUBITS = 16
+    # A memory-mapped state is streamed through in blocks of this many
+    # qubits (512MiB at double precision), so only one block has to be
+    # resident.
+    MEMMAP_BLOCK_QUBITS = 25
+    # Layers of single-qubit gates are applied as the tensor product on this
+    # many qubits at a time, which passes over the state fewer times than
+    # gate by gate while keeping the operator small.
+    LAYER_BLOCK_QUBITS = 4
+    SUPPORTS_UNITARIES = True
+
+    def __init__(
+        self,
+        num_qubits: int = BaseQSimulator.NUM_QUBITS,
+        growable: bool = False,
+        threads: int = 1,
+        memmap_path: str | None = None,
+        dtype: type[np.complexfloating] = np.complex128,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable, seed)
+        self.dtype = np.dtype(dtype)
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(threads) if threads > 1 else None
+        self.memmap_path = memmap_path
+
+        # Only the qubits below `_width` are stored; the ones above are |0>
+        # and are tensored in when a gate first touches them.
+        self._width = 0
+        self._state_vector = self._allocate(0)
+        self._state_vector[0] = 1
+        # Set while the state vector is shared with a snapshot.
+        self._shared = False
+
+        # Single-qubit gates are queued per qubit and fused into one 2x2
+        # operator, which is only applied once something depends on it.
+        self._pending: dict[int, np.ndarray] = {}
+
+    @property
+    def state_vector(self) -> np.ndarray:
+        self._flush(range(self.num_qubits))
+        self._own()
+        return self._state_vector
+
+    @state_vector.setter
+    def state_vector(self, value: np.ndarray) -> None:
+        self._pending.clear()
+        self._state_vector = value
+        self._width = len(value).bit_length() - 1
+        self._shared = False
+
+    def snapshot(self) -> Snapshot:
+        # Copy-on-write: both sides keep the same array until the simulator
+        # next modifies it, so a prefix can be resumed many times at the cost
+        # of one copy each.
+        self._shared = True
+        return Snapshot(
+            self._state_vector,
+            self._width,
+            dict(self._pending),
+            self.num_qubits,
+            list(self.free_qubits),
+        )
+
+    def restore(self, snapshot: Snapshot) -> None:
+        self._state_vector = snapshot.state_vector
+        self._width = snapshot.width
+        self._pending = dict(snapshot.pending)
+        self.num_qubits = snapshot.num_qubits
+        self.free_qubits = list(snapshot.free_qubits)
+        self._shared = True
+
+    def new_shot(self) -> None:
+        super().new_shot()
+        self._trim()
+
+    def qfree(self, qubits: list[int]) -> None:
+        super().qfree(qubits)
+        self._trim()
+
+    def _grow_state(self, count: int) -> None:
+        # New qubits are |0> and above the stored ones until they are used.
+        pass
+
+    def _trim(self) -> None:
+        # Free qubits at the top of the register are traced out (measured and
+        # dropped), so the state vector only spans up to the highest qubit in
+        # use.
+        free = set(self.free_qubits)
+        # Gates queued on free qubits that were never stored act on nothing
+        # that is kept.
+        for qubit in free:
+            if qubit >= self._width:
+                self._pending.pop(qubit, None)
+
+        width = self._width
+        while width > 0 and width - 1 in free:
+            width -= 1
+        if width == self._width:
+            return
+
+        if width == 0:
+            self._clear()
+            return
+
+        for qubit in range(width, self._width):
+            self._reset_qubit(qubit)
+        self._resize(width)
+
+    def _resize(self, width: int) -> None:
+        # The qubits above the width are |0>, so their amplitudes are the
+        # start of the longer vector and the rest is zero.
+        state_vector = self._allocate(width, suffix=".grow")
+        size = min(len(state_vector), len(self._state_vector))
+        state_vector[:size] = self._state_vector[:size]
+        if self.memmap_path is not None:
+            os.replace(self.memmap_path + ".grow", self.memmap_path)
+        self._state_vector = state_vector
+        self._width = width
+        self._shared = False
+
+    def _clear(self) -> None:
+        # Starts over from an empty register. Going through _resize replaces a
+        # memory-mapped file instead of truncating it under a snapshot.
+        self._pending.clear()
+        self._resize(0)
+        self._state_vector[0] = 1
+
+    def _own(self) -> None:
+        # A memory-mapped snapshot keeps the replaced file's mapping alive.
+        if self._shared:
+            self._resize(self._width)
+
+    def _allocate(self, num_qubits: int, suffix: str = "") -> np.ndarray:
+        if self.memmap_path is None:
+            return np.zeros(2**num_qubits, dtype=self.dtype)
+        # New files are zero-filled (and sparse on most filesystems).
+        return np.memmap(
+            self.memmap_path + suffix, dtype=self.dtype, mode="w+", shape=(2**num_qubits,)
+        )
+
+    def measure(self, qubit: int) -> int:
+        self._flush([qubit])
+        axis = self._axis(qubit)
+        prob_zeros = sum(
+            self._map(lambda chunk: norm_squared(half(chunk, axis, 0)), [axis], readonly=True)
+        )
+
+        outcome = 0 if self._random() < prob_zeros else 1
+        self._collapse(qubit, outcome, prob_zeros if outcome == 0 else 1 - prob_zeros)
+        return outcome
+
+    def _collapse(self, qubit: int, outcome: int, probability: float | None = None) -> None:
+        self._flush([qubit])
+        axis = self._axis(qubit)
+        if probability is None:
+            probability = sum(
+                self._map(
+                    lambda chunk: norm_squared(half(chunk, axis, outcome)),
+                    [axis],
+                    readonly=True,
+                )
             )
+        scale = collapse_scale(probability)
+
+        def collapse(chunk: np.ndarray) -> None:
+            half(chunk, axis, 1 - outcome)[...] = 0
+            kept = half(chunk, axis, outcome)
+            kept *= scale
+
+        self._map(collapse, [axis])
+
+    def _measure_all(self, qubits: list[int]) -> int:
+        # Draws a basis state of the whole register, whose bits on `qubits`
+        # are the joint outcome, and collapses onto it, streaming through the
+        # state instead of building the 2^k marginal. Gates pending on other
+        # qubits don't change the marginal, so only `qubits` are flushed.
+        self._flush(qubits)
+        state = int(self._draw_basis_states(np.array([self._random()]))[0])
+        outcome = sum(((state >> qubit) & 1) << i for i, qubit in enumerate(qubits))
+
+        axes = [self._axis(qubit) for qubit in qubits]
+        index = [slice(None)] * self._width
+        for i, axis in enumerate(axes):
+            index[axis] = (outcome >> i) & 1
+        index = tuple(index)
+        probability = sum(
+            self._map(lambda chunk: norm_squared(chunk[index]), axes, readonly=True)
         )
+        scale = collapse_scale(probability)
 
-    def cx(self, control: int, target: int) -> None:
-        op = np.zeros((2 ** self.NUM_QUBITS, 2 ** self.NUM_QUBITS))
+        def collapse(chunk: np.ndarray) -> None:
+            kept = chunk[index] * scale
+            chunk[...] = 0
+            chunk[index] = kept
+
+        self._map(collapse, axes)
+        return outcome
+
+    def _draw_basis_states(self, uniforms: np.ndarray) -> np.ndarray:
+        # Turns uniforms in [0, 1) into basis states drawn with probability
+        # |amplitude|^2, by a cumulative search that streams through blocks of
+        # the state vector instead of building its distribution. Pending gates
+        # are not flushed.
+        size = 2**self.MEMMAP_BLOCK_QUBITS
+        vector = self._state_vector
+        starts = range(0, len(vector), size)
+        norms = np.array([norm_squared(vector[start : start + size]) for start in starts])
+        bounds = np.cumsum(norms)
+        targets = uniforms * bounds[-1]
+        blocks = np.minimum(np.searchsorted(bounds, targets, side="right"), len(norms) - 1)
+
+        states = np.empty(len(uniforms), dtype=np.int64)
+        for block in np.unique(blocks):
+            drawn = blocks == block
+            start = int(block) * size
+            cumulative = np.cumsum(np.abs(vector[start : start + size]) ** 2)
+            found = np.searchsorted(
+                cumulative, targets[drawn] - bounds[block] + norms[block], side="right"
+            )
+            # Rounding can leave the block total just below a target; the last
+            # non-zero amplitude is the one that reaches it.
+            last = np.searchsorted(cumulative, cumulative[-1])
+            states[drawn] = start + np.minimum(found, last)
+        return states
+
+    def _reset(self, qubit: int, outcome: int | None = None) -> int:
+        if qubit >= self._width:
+            # Not stored yet, so it is |0> once its queued gates are dropped.
+            self._pending.pop(qubit, None)
+            return 0
+        if outcome is None:
+            outcome = self.measure(qubit)
+        else:
+            self._collapse(qubit, outcome)
+        if outcome == 0:
+            return 0
+        axis = self._axis(qubit)
 
-        for state in range(2 ** self.NUM_QUBITS):
-            to_state = state
-            if (state >> control) % 2 == 1:
-                to_state ^= 1 << target
+        def reset(chunk: np.ndarray) -> None:
+            half(chunk, axis, 0)[...] = half(chunk, axis, 1)
+            half(chunk, axis, 1)[...] = 0
 
-            op[to_state, state] = 1
+        self._map(reset, [axis])
+        return 1
 
-        self.state_vector = op @ self.state_vector
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        probabilities = self.probabilities(qubits)
+        return self.rng.choice(len(probabilities), size=shots, p=probabilities).tolist()
+
+    def probabilities(self, qubits: list[int]) -> np.ndarray:
+        self._flush(qubits)
+        axes = [self._axis(qubit) for qubit in qubits]
+        others = tuple(axis for axis in range(self._width) if axis not in axes)
+        marginal = sum(
+            self._map(
+                lambda chunk: (np.abs(chunk) ** 2).sum(axis=others, keepdims=True),
+                axes,
+                readonly=True,
+            )
+        )
+
+        marginal = marginal.squeeze(axis=others)
+        kept = sorted(axes)
+        marginal = marginal.transpose([kept.index(axis) for axis in reversed(axes)])
+        marginal = marginal.reshape(-1)
+        return marginal / marginal.sum()
 
     def mcz(self, qubits: list[int]) -> None:
-        op = np.eye(2 ** self.NUM_QUBITS)
+        self._flush(qubits)
+        axes = [self._axis(qubit) for qubit in qubits]
+        self._map(lambda chunk: negate_all_ones(chunk, axes), axes)
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        self._flush(qubits)
+        axes = [self._axis(qubit) for qubit in qubits]
+        self._map(lambda chunk: phase_all_ones(chunk, axes, phase), axes)
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        self._flush(qubits)
+        self._multiply_diagonal(diagonal, qubits)
+
+    def _multiply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        axes = [self._axis(qubit) for qubit in qubits]
+        mask = diagonal_mask(self._width, tuple(axes), diagonal)
+
+        def multiply(chunk: np.ndarray) -> None:
+            chunk *= mask
+
+        self._map(multiply, axes)
+
+    def _apply_unitary(self, unitary: np.ndarray, qubits: list[int]) -> None:
+        self._flush(qubits)
+        unitary = unitary.astype(self.dtype, copy=False)
+        axes = [self._axis(qubit) for qubit in qubits]
+        self._map(lambda chunk: apply_unitary(chunk, unitary, axes), axes)
+
+    def _apply_layer(self, ops: list[np.ndarray], qubits: list[int]) -> None:
+        # Queued gates are folded into the layer instead of being flushed
+        # one by one.
+        ops = [op @ self._pending.pop(qubit, IDENTITY) for op, qubit in zip(ops, qubits)]
+        self._flush(qubits)
+
+        # X on several qubits just permutes the amplitudes, and phase gates
+        # combine into one diagonal; everything else is grouped into blocks.
+        flipped: list[int] = []
+        diagonal: list[tuple[np.ndarray, int]] = []
+        general: list[tuple[np.ndarray, int]] = []
+        for op, qubit in zip(ops, qubits):
+            if np.allclose(op, IDENTITY):
+                continue
+            if np.array_equal(op, X):
+                flipped.append(qubit)
+            elif op[0, 1] == 0 and op[1, 0] == 0:
+                diagonal.append((op, qubit))
+            else:
+                general.append((op, qubit))
+
+        if flipped:
+            axes = tuple(self._axis(qubit) for qubit in flipped)
+
+            def flip(chunk: np.ndarray) -> None:
+                chunk[...] = np.flip(chunk, axes)
+
+            self._map(flip, list(axes))
+
+        block = self.LAYER_BLOCK_QUBITS
+        for start in range(0, len(diagonal), block):
+            gates = diagonal[start : start + block]
+            # Bit i of the combined index is gates[i], so it is the last factor.
+            entries = functools.reduce(np.kron, [np.diag(op) for op, _ in reversed(gates)])
+            self._multiply_diagonal(entries, [qubit for _, qubit in gates])
+        for start in range(0, len(general), block):
+            gates = general[start : start + block]
+            unitary = functools.reduce(np.kron, [op for op, _ in reversed(gates)])
+            unitary = unitary.astype(self.dtype, copy=False)
+            axes = [self._axis(qubit) for _, qubit in gates]
+            self._map(lambda chunk: apply_unitary(chunk, unitary, axes), axes)
+
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        if not controls:
+            fused = op @ self._pending.pop(target, IDENTITY)
+            if not np.allclose(fused, IDENTITY):
+                self._pending[target] = fused
+            return
+
+        self._flush([target, *controls])
+        self._apply_now(op, target, controls)
+
+    def _flush(self, qubits: Iterable[int] | None = None) -> None:
+        # Flushing comes before anything touches the state, so it is also
+        # where qubits above the width get tensored in.
+        qubits = list(self._pending) if qubits is None else list(qubits)
+        if qubits and max(qubits) >= self._width:
+            self._resize(max(qubits) + 1)
+        for qubit in qubits:
+            if (op := self._pending.pop(qubit, None)) is not None:
+                self._apply_now(op, qubit)
+
+    def _apply_now(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        op = op.astype(self.dtype, copy=False)
+        axis = self._axis(target)
+        control_axes = [self._axis(control) for control in controls]
+        self._map(
+            lambda chunk: apply_controlled(chunk, op, axis, control_axes),
+            [axis, *control_axes],
+        )
+
+    def _map(
+        self,
+        func: Callable[[np.ndarray], Any],
+        busy_axes: list[int],
+        readonly: bool = False,
+    ) -> list[Any]:
+        # Runs `func` on disjoint chunks of the state, on the thread pool
+        # (NumPy releases the GIL inside the kernels) and/or in blocks small
+        # enough to stream through a memory-mapped state.
+        if not readonly:
+            self._own()
+        count = 1
+        if self._executor is not None and self._width >= self.PARALLEL_MIN_QUBITS:
+            count = self.threads
+        if self.memmap_path is not None:
+            count = max(count, 2 ** (self._width - self.MEMMAP_BLOCK_QUBITS))
+
+        tensor = self._tensor()
+        if count == 1:
+            return [func(tensor)]
+        chunks = split_tensor(tensor, busy_axes, count)
+        if self._executor is None:
+            return [func(chunk) for chunk in chunks]
+        return list(self._executor.map(func, chunks))
 
-        for state in range(2 ** self.NUM_QUBITS):
-            if all((state >> qubit) % 2 == 1 for qubit in qubits):
-                op[state, state] = -1
+    def _tensor(self) -> np.ndarray:
+        return self._state_vector.reshape((2,) * self._width)
 
-        self.state_vector = op @ self.state_vector
+    def _axis(self, qubit: int) -> int:
+        return self._width - qubit - 1
 
     def to_string(self) -> str:
         return "QSimulator"
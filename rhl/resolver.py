@@ -1,11 +1,13 @@
 import logging
 from typing import NoReturn
 
-from . import scope, types, node, exceptions
+from . import builtins, scope, types, node, exceptions
 
 
 logger = logging.getLogger(__name__)
 
+QUBIT_LIST_TYPE = types.ListType.get_or_create(element_type=types.qubit_type)
+
 
 class Resolver:
     def __init__(self):
@@ -16,6 +18,22 @@ class Resolver:
         self._return_type_checked = []  # TODO: isn't really good...
         self._functions = []
 
+        self.builtin_references: dict[str, list[node.Node]] = {}
+        self.builtin_calls: dict[str, list[node.Node]] = {}
+
+        # A function is pure when its calls only apply gates to its qubit
+        # arguments: it only takes qubits, returns nothing, and only touches
+        # its own locals, pure builtins and other pure functions. Pure
+        # functions are identified by name and the scope level of their
+        # declaration, and the current ones are assumed pure until proven
+        # otherwise so that recursion works. Rebinding a name drops it, along
+        # with every function already found pure that refers to it.
+        self._pure_functions: set[tuple[str, int]] = set()
+        self._function_depths: list[int] = []
+        self._purity: list[bool] = []
+        self._callees: list[set[tuple[str, int]]] = []
+        self._dependents: dict[tuple[str, int], list[tuple[node.Node, tuple[str, int]]]] = {}
+
     def _raise_exception(self, message: str, node: node.Node) -> NoReturn:
         raise exceptions.RHLResolverError(message, node)
 
@@ -70,19 +88,43 @@ class Resolver:
         node.func_type = function_type
 
         self._scope.declare(name, function_type)
+        binding = (name, self._scope.depth - 1)
+        self._pure_functions.add(binding)
 
         self._scope.push()
         for param_name, param_type in zip(params_names, params_types):
             self._scope.declare(param_name, param_type)
         self._expected_return_types.insert(0, return_type)
         self._return_type_checked.insert(0, False)
+        self._function_depths.insert(0, self._scope.depth)
+        only_qubits = all(
+            param_type in (types.qubit_type, QUBIT_LIST_TYPE) for param_type in params_types
+        )
+        self._purity.insert(0, only_qubits and return_type == types.none_type)
+        self._callees.insert(0, set())
 
         self.visit(node.get("body"))
 
         if not self._return_type_checked.pop(0) and return_type != types.none_type:
             self._raise_exception(f"Function didn't return a value", node)
         self._expected_return_types.pop(0)
+        self._function_depths.pop(0)
+        callees = self._callees.pop(0)
+        node.pure = self._purity.pop(0) and callees <= self._pure_functions
+        if node.pure:
+            for callee in callees:
+                self._dependents.setdefault(callee, []).append((node, binding))
+        else:
+            self._pure_functions.discard(binding)
         self._scope.pop()
+        self._pure_functions = {
+            binding for binding in self._pure_functions if binding[1] < self._scope.depth
+        }
+        self._dependents = {
+            callee: dependents
+            for callee, dependents in self._dependents.items()
+            if callee[1] < self._scope.depth
+        }
 
         logger.debug(f"Exiting function '{name}'")
         self._functions.pop(0)
@@ -139,10 +181,43 @@ class Resolver:
             var_type, dist = res
             logger.debug(f"Resolved variable '{node.text}': {var_type=} and {dist=}")
             node.scope_distance = dist
+            if self._is_builtin(dist):
+                self.builtin_references.setdefault(node.text, []).append(node)
+            if not self._is_local(dist) and not self._is_pure_callee(node.text, dist):
+                self._mark_impure()
+            binding = (node.text, self._scope.depth - 1 - dist)
+            if self._callees and binding in self._pure_functions:
+                self._callees[0].add(binding)
             return var_type
 
         self._raise_exception(f"No variable named {node.text}", node)
 
+    def _is_builtin(self, dist: int) -> bool:
+        return dist == self._scope.depth - 1
+
+    def _is_local(self, dist: int) -> bool:
+        if not self._function_depths:
+            return True
+        return self._scope.depth - dist >= self._function_depths[0]
+
+    def _is_pure_callee(self, name: str, dist: int) -> bool:
+        if self._is_builtin(dist):
+            return name in builtins.PURE_BUILTINS
+        return (name, self._scope.depth - 1 - dist) in self._pure_functions
+
+    def _mark_impure(self) -> None:
+        if self._purity:
+            self._purity[0] = False
+
+    def _rebind(self, binding: tuple[str, int]) -> None:
+        # The name may now hold any function, so neither it nor the functions
+        # calling it can be memoized.
+        self._pure_functions.discard(binding)
+        for function, function_binding in self._dependents.pop(binding, []):
+            if function.pure:
+                function.pure = False
+                self._rebind(function_binding)
+
     def _resolve_group(self, node: node.Node) -> types.Type:
         return self.resolve(node.get("expression"))
 
@@ -215,6 +290,7 @@ class Resolver:
             )
 
         self._scope.declare(node.get("name").text, var_type)
+        self._rebind((node.get("name").text, self._scope.depth - 1))
         return var_type
 
     def _resolve_variable_assignment(self, node: node.Node) -> types.Type:
@@ -231,12 +307,22 @@ class Resolver:
                 f"Resolved variable '{node.get('name').text}': {var_type=} and {dist=}"
             )
             node.scope_distance = dist
+            if not self._is_local(dist):
+                self._mark_impure()
+            self._rebind((node.get("name").text, self._scope.depth - 1 - dist))
             return var_type
 
         self._raise_exception(f"No variable named {node.get('name').text}", node)
 
     def _resolve_call(self, node: node.Node) -> types.Type:
-        func_type = self.resolve(node.get("function"))
+        function = node.get("function")
+        func_type = self.resolve(function)
+        if function.type == "identifier" and self._is_builtin(function.scope_distance):
+            self.builtin_calls.setdefault(function.text, []).append(node)
+        if function.type != "identifier" or not self._is_pure_callee(
+            function.text, function.scope_distance
+        ):
+            self._mark_impure()
         if not isinstance(func_type, types.FunctionType):
             self._raise_exception("tried to call a non-function variable", node)
 
@@ -0,0 +1,214 @@
+from dataclasses import dataclass
+from typing import Callable, Hashable
+import numpy as np
+
+from . import qsim
+
+
+@dataclass(frozen=True)
+class SamplingSnapshot:
+    dense: qsim.Snapshot
+    history: list[Hashable]
+    operations: list[Callable[[], None]]
+
+
+class SamplingQSimulator(qsim.QSimulator):
+    # A section starts whenever every qubit is free, so the distribution of
+    # its measurements only depends on the operations recorded since. Gates
+    # are recorded instead of applied, and the first measurement of a section
+    # draws `shots` joint samples of the whole register at once. Repeating the
+    # same section (e.g. running the same circuit in a loop) consumes the
+    # cached samples without simulating again.
+    MAX_CACHED_SECTIONS = 256
+
+    def __init__(
+        self,
+        num_qubits: int = qsim.BaseQSimulator.NUM_QUBITS,
+        growable: bool = False,
+        threads: int = 1,
+        memmap_path: str | None = None,
+        dtype: type[np.complexfloating] = np.complex128,
+        shots: int = 1,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable, threads, memmap_path, dtype, seed)
+        self.shots = shots
+
+        self._history: list[Hashable] = []
+        self._operations: list[Callable[[], None]] = []
+        self._applied = 0
+        self._sample: int | None = None
+        self._fresh_section = False
+        self._samples: dict[tuple[Hashable, ...], list[int]] = {}
+
+    @property
+    def state_vector(self) -> np.ndarray:
+        self._materialize()
+        return super().state_vector
+
+    def new_shot(self) -> None:
+        super().new_shot()
+        self._start_section()
+
+    def qalloc(self, length: int) -> list[int]:
+        # When every qubit is free, a fresh |0...0> register is equivalent to
+        # resetting the allocated qubits one by one.
+        self._fresh_section = len(self.free_qubits) == self.num_qubits
+        if self._fresh_section:
+            self._start_section()
+
+        try:
+            allocated = super().qalloc(length)
+        finally:
+            fresh_section, self._fresh_section = self._fresh_section, False
+
+        if fresh_section:
+            self._record(("qalloc", tuple(allocated)), lambda: None)
+        return allocated
+
+    def qfree(self, qubits: list[int]) -> None:
+        super().qfree(qubits)
+        if len(self.free_qubits) == self.num_qubits:
+            self._start_section()
+
+    def _trim(self) -> None:
+        # Once every qubit is free the next section starts from a fresh
+        # register, so there is nothing to trace out.
+        if len(self.free_qubits) < self.num_qubits:
+            super()._trim()
+
+    def snapshot(self) -> SamplingSnapshot:
+        # The section recorded so far stays the key of the cached samples, so
+        # every variant resumed from the snapshot extends the same history.
+        self._materialize()
+        return SamplingSnapshot(
+            super().snapshot(), list(self._history), list(self._operations)
+        )
+
+    def restore(self, snapshot: SamplingSnapshot) -> None:
+        super().restore(snapshot.dense)
+        self._history = list(snapshot.history)
+        self._operations = list(snapshot.operations)
+        self._applied = len(self._operations)
+        self._sample = None
+
+    def _reset(self, qubit: int, outcome: int | None = None) -> int:
+        if self._fresh_section:
+            return 0
+
+        self._materialize()
+        if outcome is None:
+            outcome = super().measure(qubit)
+        else:
+            super()._collapse(qubit, outcome)
+        if outcome == 1:
+            super()._apply(qsim.X, qubit)
+
+        def reset() -> None:
+            self._collapse(qubit, outcome)
+            if outcome == 1:
+                super(SamplingQSimulator, self)._apply(qsim.X, qubit)
+
+        self._record(("reset", qubit, outcome), reset)
+        self._applied = len(self._operations)
+        return outcome
+
+    def measure(self, qubit: int) -> int:
+        if self._sample is None:
+            self._sample = self._draw_sample()
+
+        outcome = (self._sample >> qubit) & 1
+        self._history.append(("measure", qubit, outcome))
+        self._operations.append(lambda: self._collapse(qubit, outcome))
+        return outcome
+
+    def collapse(self, qubit: int, outcome: int) -> None:
+        if outcome not in (0, 1):
+            raise Exception(f"Invalid measurement outcome {outcome}")
+        self._record(("collapse", qubit, outcome), lambda: self._collapse(qubit, outcome))
+
+    def _measure_all(self, qubits: list[int]) -> int:
+        # Reading the bits off the drawn sample one by one costs nothing and
+        # keeps the section history the same as for single measurements.
+        return qsim.BaseQSimulator._measure_all(self, qubits)
+
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        self._materialize()
+        return super().sample(qubits, shots)
+
+    def probabilities(self, qubits: list[int]) -> np.ndarray:
+        self._materialize()
+        return super().probabilities(qubits)
+
+    def mcz(self, qubits: list[int]) -> None:
+        qubits = list(qubits)
+        self._record(
+            ("mcz", tuple(qubits)), lambda: super(SamplingQSimulator, self).mcz(qubits)
+        )
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        self._record(
+            ("mcphase", tuple(qubits), phase),
+            lambda: super(SamplingQSimulator, self)._mcphase(qubits, phase),
+        )
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        self._record(
+            ("diagonal", diagonal.tobytes(), tuple(qubits)),
+            lambda: super(SamplingQSimulator, self)._apply_diagonal(diagonal, qubits),
+        )
+
+    def _apply_unitary(self, unitary: np.ndarray, qubits: list[int]) -> None:
+        self._record(
+            ("unitary", unitary.tobytes(), tuple(qubits)),
+            lambda: super(SamplingQSimulator, self)._apply_unitary(unitary, qubits),
+        )
+
+    def _apply_layer(self, ops: list[np.ndarray], qubits: list[int]) -> None:
+        self._record(
+            ("layer", tuple(op.tobytes() for op in ops), tuple(qubits)),
+            lambda: super(SamplingQSimulator, self)._apply_layer(ops, qubits),
+        )
+
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        self._record(
+            ("apply", op.tobytes(), target, tuple(controls)),
+            lambda: super(SamplingQSimulator, self)._apply(op, target, controls),
+        )
+
+    def _record(self, key: Hashable, operation: Callable[[], None]) -> None:
+        self._history.append(key)
+        self._operations.append(operation)
+        self._sample = None
+
+    def _start_section(self) -> None:
+        self._history = []
+        self._operations = []
+        self._applied = 0
+        self._sample = None
+
+    def _materialize(self) -> None:
+        if self._applied == 0:
+            self._clear()
+
+        for operation in self._operations[self._applied :]:
+            operation()
+        self._applied = len(self._operations)
+
+    def _draw_sample(self) -> int:
+        key = tuple(self._history)
+        samples = self._samples.pop(key, None)
+        if not samples:
+            self._materialize()
+            self._flush()
+            samples = self._draw_basis_states(self.rng.random(self.shots)).tolist()
+
+        sample = samples.pop()
+        if samples:
+            if len(self._samples) >= self.MAX_CACHED_SECTIONS:
+                self._samples.pop(next(iter(self._samples)))
+            self._samples[key] = samples
+        return sample
+
+    def to_string(self) -> str:
+        return "SamplingQSimulator"
@@ -11,6 +11,10 @@ class Scope:
     def pop(self) -> None:
         self._stack.pop(0)
 
+    @property
+    def depth(self) -> int:
+        return len(self._stack)
+
     def get(self, name: str) -> tuple[types.Type, int] | None:
         for index, scope in enumerate(self._stack):
             if name in scope:
@@ -0,0 +1,113 @@
+import numpy as np
+
+from . import qsim
+
+
+class SparseQSimulator(qsim.BaseQSimulator):
+    # Amplitudes smaller than this are dropped, so interference that cancels
+    # a basis state (e.g. h;h) actually shrinks the state.
+    EPSILON = 1e-12
+
+    def __init__(
+        self,
+        num_qubits: int = qsim.BaseQSimulator.NUM_QUBITS,
+        growable: bool = False,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable, seed)
+        self.amplitudes: dict[int, complex] = {0: 1.0}
+
+    def _grow_state(self, count: int) -> None:
+        # New qubits are high-order |0> bits, so no basis index changes.
+        pass
+
+    def measure(self, qubit: int) -> int:
+        mask = 1 << qubit
+        prob_zeros = 0.0
+        prob_ones = 0.0
+        for index, amplitude in self.amplitudes.items():
+            if index & mask:
+                prob_ones += abs(amplitude) ** 2
+            else:
+                prob_zeros += abs(amplitude) ** 2
+
+        outcome = 0 if self._random() < prob_zeros else 1
+        self._collapse(qubit, outcome, prob_zeros if outcome == 0 else prob_ones)
+        return outcome
+
+    def _collapse(self, qubit: int, outcome: int, probability: float | None = None) -> None:
+        mask = 1 << qubit
+        kept = {
+            index: amplitude
+            for index, amplitude in self.amplitudes.items()
+            if bool(index & mask) == outcome
+        }
+        if probability is None:
+            probability = sum(abs(amplitude) ** 2 for amplitude in kept.values())
+        scale = qsim.collapse_scale(probability)
+        self.amplitudes = {index: amplitude * scale for index, amplitude in kept.items()}
+
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        distribution: dict[int, float] = {}
+        for index, amplitude in self.amplitudes.items():
+            outcome = sum(((index >> qubit) & 1) << i for i, qubit in enumerate(qubits))
+            distribution[outcome] = distribution.get(outcome, 0) + abs(amplitude) ** 2
+
+        outcomes = list(distribution.keys())
+        probabilities = np.array(list(distribution.values()))
+        chosen = self.rng.choice(
+            len(outcomes), size=shots, p=probabilities / probabilities.sum()
+        )
+        return [outcomes[i] for i in chosen]
+
+    def probabilities(self, qubits: list[int]) -> np.ndarray:
+        indices = np.fromiter(self.amplitudes.keys(), dtype=np.int64)
+        weights = np.abs(np.fromiter(self.amplitudes.values(), dtype=complex)) ** 2
+        outcomes = np.zeros(len(indices), dtype=np.int64)
+        for i, qubit in enumerate(qubits):
+            outcomes |= ((indices >> qubit) & 1) << i
+        probabilities = np.bincount(outcomes, weights=weights, minlength=2 ** len(qubits))
+        return probabilities / probabilities.sum()
+
+    def mcz(self, qubits: list[int]) -> None:
+        mask = sum(1 << qubit for qubit in qubits)
+        for index in self.amplitudes:
+            if index & mask == mask:
+                self.amplitudes[index] = -self.amplitudes[index]
+
+    def _mcphase(self, qubits: list[int], phase: complex) -> None:
+        mask = sum(1 << qubit for qubit in qubits)
+        for index in self.amplitudes:
+            if index & mask == mask:
+                self.amplitudes[index] *= phase
+
+    def _apply_diagonal(self, diagonal: np.ndarray, qubits: list[int]) -> None:
+        for index in self.amplitudes:
+            entry = sum(((index >> qubit) & 1) << i for i, qubit in enumerate(qubits))
+            self.amplitudes[index] *= diagonal[entry]
+
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        target_mask = 1 << target
+        controls_mask = sum(1 << control for control in controls)
+
+        amplitudes: dict[int, complex] = {}
+        for index, amplitude in self.amplitudes.items():
+            if index & controls_mask != controls_mask:
+                amplitudes[index] = amplitudes.get(index, 0) + amplitude
+                continue
+
+            bit = (index >> target) & 1
+            for out_bit, out_index in ((0, index & ~target_mask), (1, index | target_mask)):
+                if coefficient := op[out_bit, bit]:
+                    amplitudes[out_index] = (
+                        amplitudes.get(out_index, 0) + coefficient * amplitude
+                    )
+
+        self.amplitudes = {
+            index: amplitude
+            for index, amplitude in amplitudes.items()
+            if abs(amplitude) > self.EPSILON
+        }
+
+    def to_string(self) -> str:
+        return "SparseQSimulator"
@@ -0,0 +1,206 @@
+import numpy as np
+
+from . import builtins, node, qsim
+
+
+# Quantum builtins the tableau can simulate. mcz is only a Clifford gate for
+# at most two qubits, so it is checked separately per call.
+SUPPORTED_BUILTINS = {
+    "qalloc",
+    "qfree",
+    "measure",
+    "measure_all",
+    "x",
+    "h",
+    "cx",
+    "z",
+    "s",
+    "x_all",
+    "h_all",
+}
+MAX_CLIFFORD_MCZ_QUBITS = 2
+
+
+def is_clifford_program(
+    builtin_references: dict[str, list[node.Node]],
+    builtin_calls: dict[str, list[node.Node]],
+) -> bool:
+    for name, references in builtin_references.items():
+        if name not in builtins.QUANTUM_BUILTINS or name in SUPPORTED_BUILTINS:
+            continue
+
+        if name != "mcz":
+            return False
+
+        # Passing mcz around as a value hides the qubit count.
+        calls = builtin_calls.get(name, [])
+        if len(calls) != len(references):
+            return False
+
+        for call in calls:
+            qubits = call.get_all("argument")[0]
+            if qubits.type != "list":
+                return False
+            if len(qubits.get_all("value")) > MAX_CLIFFORD_MCZ_QUBITS:
+                return False
+
+    return True
+
+
+class StabilizerQSimulator(qsim.BaseQSimulator):
+    # CHP tableau (Aaronson & Gottesman): rows [0, n) are destabilizers,
+    # rows [n, 2n) are stabilizers and row 2n is scratch space.
+    def __init__(
+        self,
+        num_qubits: int = qsim.BaseQSimulator.NUM_QUBITS,
+        growable: bool = False,
+        seed: int | np.random.SeedSequence | None = None,
+    ):
+        super().__init__(num_qubits, growable, seed)
+        n = self.num_qubits
+        self.xs = np.zeros((2 * n + 1, n), dtype=bool)
+        self.zs = np.zeros((2 * n + 1, n), dtype=bool)
+        self.signs = np.zeros(2 * n + 1, dtype=bool)
+        self.xs[np.arange(n), np.arange(n)] = True
+        self.zs[np.arange(n) + n, np.arange(n)] = True
+
+    def _grow_state(self, count: int) -> None:
+        n = self.num_qubits
+        m = n + count
+        xs = np.zeros((2 * m + 1, m), dtype=bool)
+        zs = np.zeros((2 * m + 1, m), dtype=bool)
+        signs = np.zeros(2 * m + 1, dtype=bool)
+
+        for old_rows, new_start in ((slice(0, n), 0), (slice(n, 2 * n), m)):
+            xs[new_start : new_start + n, :n] = self.xs[old_rows]
+            zs[new_start : new_start + n, :n] = self.zs[old_rows]
+            signs[new_start : new_start + n] = self.signs[old_rows]
+
+        new_qubits = np.arange(n, m)
+        xs[new_qubits, new_qubits] = True
+        zs[new_qubits + m, new_qubits] = True
+
+        self.xs, self.zs, self.signs = xs, zs, signs
+
+    def x(self, qubit: int) -> None:
+        self.signs ^= self.zs[:, qubit]
+
+    def z(self, qubit: int) -> None:
+        self.signs ^= self.xs[:, qubit]
+
+    def h(self, qubit: int) -> None:
+        self.signs ^= self.xs[:, qubit] & self.zs[:, qubit]
+        self.xs[:, qubit], self.zs[:, qubit] = (
+            self.zs[:, qubit].copy(),
+            self.xs[:, qubit].copy(),
+        )
+
+    def s(self, qubit: int) -> None:
+        self.signs ^= self.xs[:, qubit] & self.zs[:, qubit]
+        self.zs[:, qubit] ^= self.xs[:, qubit]
+
+    def cx(self, control: int, target: int) -> None:
+        self.signs ^= (
+            self.xs[:, control]
+            & self.zs[:, target]
+            & ~(self.xs[:, target] ^ self.zs[:, control])
+        )
+        self.xs[:, target] ^= self.xs[:, control]
+        self.zs[:, control] ^= self.zs[:, target]
+
+    def mcz(self, qubits: list[int]) -> None:
+        match qubits:
+            case []:
+                pass
+            case [qubit]:
+                self.z(qubit)
+            case [control, target]:
+                self.h(target)
+                self.cx(control, target)
+                self.h(target)
+            case _:
+                raise Exception(f"mcz on {len(qubits)} qubits is not a Clifford gate")
+
+    def _apply(self, op: np.ndarray, target: int, controls: tuple[int, ...] = ()) -> None:
+        if not controls:
+            for clifford_op, gate in (
+                (qsim.X, self.x),
+                (qsim.H, self.h),
+                (qsim.Z, self.z),
+                (qsim.S, self.s),
+            ):
+                if np.allclose(op, clifford_op):
+                    return gate(target)
+        elif len(controls) == 1:
+            if np.allclose(op, qsim.X):
+                return self.cx(controls[0], target)
+            if np.allclose(op, qsim.Z):
+                return self.mcz([controls[0], target])
+
+        raise Exception("Stabilizer simulator can only apply Clifford gates")
+
+    def measure(self, qubit: int) -> int:
+        return self._measure(qubit, None)
+
+    def _collapse(self, qubit: int, outcome: int) -> None:
+        self._measure(qubit, outcome)
+
+    def _measure(self, qubit: int, forced: int | None) -> int:
+        # `forced` is the outcome to collapse onto instead of sampling one.
+        n = self.num_qubits
+        anticommuting = np.flatnonzero(self.xs[n : 2 * n, qubit])
+
+        if len(anticommuting) == 0:
+            # Deterministic outcome: accumulate the stabilizers that generate
+            # Z_qubit into the scratch row and read off its sign.
+            self.xs[2 * n] = False
+            self.zs[2 * n] = False
+            self.signs[2 * n] = False
+            for i in np.flatnonzero(self.xs[:n, qubit]):
+                self._rowsum(np.array([2 * n]), i + n)
+            outcome = int(self.signs[2 * n])
+            if forced is not None and forced != outcome:
+                raise Exception("Measurement outcome has probability zero")
+            return outcome
+
+        p = anticommuting[0] + n
+        targets = np.flatnonzero(self.xs[: 2 * n, qubit])
+        self._rowsum(targets[targets != p], p)
+
+        self.xs[p - n], self.zs[p - n], self.signs[p - n] = (
+            self.xs[p],
+            self.zs[p],
+            self.signs[p],
+        )
+        outcome = int(self._random() < 0.5) if forced is None else forced
+        self.xs[p] = False
+        self.zs[p] = False
+        self.zs[p, qubit] = True
+        self.signs[p] = outcome
+        return outcome
+
+    def _rowsum(self, targets: np.ndarray, source: int) -> None:
+        # Multiplies the Pauli at row `source` into every row in `targets`,
+        # tracking the phase as a power of i.
+        x1 = self.xs[source].astype(np.int8)
+        z1 = self.zs[source].astype(np.int8)
+        x2 = self.xs[targets].astype(np.int8)
+        z2 = self.zs[targets].astype(np.int8)
+
+        phases = np.where(
+            x1 & z1,
+            z2 - x2,
+            np.where(x1, z2 * (2 * x2 - 1), np.where(z1, x2 * (1 - 2 * z2), 0)),
+        )
+        total = (
+            2 * self.signs[targets].astype(np.int64)
+            + 2 * int(self.signs[source])
+            + phases.sum(axis=1)
+        ) % 4
+
+        self.signs[targets] = total == 2
+        self.xs[targets] ^= self.xs[source]
+        self.zs[targets] ^= self.zs[source]
+
+    def to_string(self) -> str:
+        return "StabilizerQSimulator"
@@ -0,0 +1,296 @@
+from enum import IntEnum
+import struct
+from typing import Any, BinaryIO, Iterable
+
+import numpy as np
+
+from . import objects, qsim
+
+
+MAGIC = b"RHLT\x01"
+
+# Gates with their own opcode; anything else is stored as a full matrix.
+GATES = [qsim.X, qsim.H, qsim.Z, qsim.S, qsim.T]
+
+
+class Op(IntEnum):
+    QALLOC = 1
+    QFREE = 2
+    MEASURE = 3
+    GATE = 4
+    MATRIX = 5
+    MCZ = 6
+    SAMPLE = 7
+    NEW_SHOT = 8
+    DIAGONAL = 9
+    UNITARY = 10
+    SNAPSHOT = 11
+    RESTORE = 12
+    RELEASE = 13
+    MCPHASE = 14
+    RESET = 15
+
+
+def _pack_qubits(qubits: Iterable[int]) -> bytes:
+    qubits = list(qubits)
+    return struct.pack(f"<I{len(qubits)}I", len(qubits), *qubits)
+
+
+def _unpack_qubits(data: bytes, offset: int) -> tuple[list[int], int]:
+    (count,) = struct.unpack_from("<I", data, offset)
+    offset += 4
+    qubits = list(struct.unpack_from(f"<{count}I", data, offset))
+    return qubits, offset + 4 * count
+
+
+class TraceRecorder(objects.Object):
+    # Wraps a simulator and writes every call the builtins make on it to a
+    # compact binary trace, which `replay` can feed to a simulator directly.
+    def __init__(self, simulator: qsim.BaseQSimulator, path: str):
+        self.simulator = simulator
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(MAGIC)
+        self._snapshots: list[Any] = []
+        simulator.reset_log = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.simulator, name)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def qalloc(self, length: int) -> list[int]:
+        qubits = self.simulator.qalloc(length)
+        self._write_resets()
+        self._file.write(struct.pack("<B", Op.QALLOC) + _pack_qubits(qubits))
+        return qubits
+
+    def qfree(self, qubits: list[int]) -> None:
+        self.simulator.qfree(qubits)
+        self._write_resets()
+        self._file.write(struct.pack("<B", Op.QFREE) + _pack_qubits(qubits))
+
+    def _write_resets(self) -> None:
+        # Outcomes of the measurements the call made by itself, written ahead
+        # of it so that replay can force them.
+        for qubit, outcome in self.simulator.reset_log:
+            self._file.write(struct.pack("<BIB", Op.RESET, qubit, outcome))
+        self.simulator.reset_log.clear()
+
+    def measure(self, qubit: int) -> int:
+        outcome = self.simulator.measure(qubit)
+        self._file.write(struct.pack("<BIB", Op.MEASURE, qubit, outcome))
+        return outcome
+
+    def measure_all(self, qubits: list[int]) -> int:
+        # Stored as single measurements of the drawn bits.
+        qubits = list(qubits)
+        outcome = self.simulator.measure_all(qubits)
+        for i, qubit in enumerate(qubits):
+            self._file.write(struct.pack("<BIB", Op.MEASURE, qubit, (outcome >> i) & 1))
+        return outcome
+
+    def collapse(self, qubit: int, outcome: int) -> None:
+        self.simulator.collapse(qubit, outcome)
+        self._file.write(struct.pack("<BIB", Op.MEASURE, qubit, outcome))
+
+    def sample(self, qubits: list[int], shots: int) -> list[int]:
+        self._file.write(struct.pack("<BI", Op.SAMPLE, shots) + _pack_qubits(qubits))
+        return self.simulator.sample(qubits, shots)
+
+    def new_shot(self) -> None:
+        self._file.write(struct.pack("<B", Op.NEW_SHOT))
+        self.simulator.new_shot()
+        self._snapshots = []
+
+    def snapshot(self) -> Any:
+        self._file.write(struct.pack("<B", Op.SNAPSHOT))
+        snapshot = self.simulator.snapshot()
+        self._snapshots.append(snapshot)
+        return snapshot
+
+    def restore(self, snapshot: Any) -> None:
+        self._file.write(struct.pack("<BI", Op.RESTORE, self._back(snapshot)))
+        self.simulator.restore(snapshot)
+
+    def release(self, snapshot: Any) -> None:
+        back = self._back(snapshot)
+        self._file.write(struct.pack("<BI", Op.RELEASE, back))
+        self._snapshots[-back] = None
+        self.simulator.release(snapshot)
+
+    def _back(self, snapshot: Any) -> int:
+        # Counted back from the latest snapshot, so the traces of parallel
+        # workers can be concatenated.
+        index = next(i for i, taken in enumerate(self._snapshots) if taken is snapshot)
+        return len(self._snapshots) - index
+
+    def x(self, qubit: int) -> None:
+        self.apply(qsim.X, qubit)
+
+    def h(self, qubit: int) -> None:
+        self.apply(qsim.H, qubit)
+
+    def cx(self, control: int, target: int) -> None:
+        self.apply(qsim.X, target, (control,))
+
+    def mcz(self, qubits: list[int]) -> None:
+        self._file.write(struct.pack("<B", Op.MCZ) + _pack_qubits(qubits))
+        self.simulator.mcz(qubits)
+
+    def mcphase(self, qubits: Iterable[int], phase: complex) -> None:
+        qubits = list(qubits)
+        self._file.write(
+            struct.pack("<B", Op.MCPHASE)
+            + _pack_qubits(qubits)
+            + struct.pack("<2d", phase.real, phase.imag)
+        )
+        self.simulator.mcphase(qubits, phase)
+
+    def apply(self, op: np.ndarray, target: int, controls: Iterable[int] = ()) -> None:
+        controls = tuple(controls)
+        self._write_gate(op, target, controls)
+        self.simulator.apply(op, target, controls)
+
+    def apply_layer(self, ops: Iterable[np.ndarray], qubits: Iterable[int]) -> None:
+        # Stored gate by gate; replaying them one at a time gives the same state.
+        ops = list(ops)
+        qubits = list(qubits)
+        for op, qubit in zip(ops, qubits):
+            self._write_gate(op, qubit, ())
+        self.simulator.apply_layer(ops, qubits)
+
+    def _write_gate(self, op: np.ndarray, target: int, controls: tuple[int, ...]) -> None:
+        for index, gate in enumerate(GATES):
+            if np.array_equal(op, gate):
+                record = struct.pack("<BBI", Op.GATE, index, target)
+                break
+        else:
+            matrix = np.asarray(op, dtype=complex).reshape(-1)
+            record = struct.pack(
+                "<BI8d",
+                Op.MATRIX,
+                target,
+                *[part for value in matrix for part in (value.real, value.imag)],
+            )
+        self._file.write(record + _pack_qubits(controls))
+
+    def apply_diagonal(self, diagonal: np.ndarray, qubits: Iterable[int]) -> None:
+        qubits = list(qubits)
+        entries = np.asarray(diagonal, dtype=complex)
+        self._file.write(
+            struct.pack("<B", Op.DIAGONAL)
+            + _pack_qubits(qubits)
+            + struct.pack(f"<{2 * len(entries)}d", *entries.view(np.float64))
+        )
+        self.simulator.apply_diagonal(diagonal, qubits)
+
+    def apply_unitary(self, unitary: np.ndarray, qubits: Iterable[int]) -> None:
+        qubits = list(qubits)
+        entries = np.asarray(unitary, dtype=complex).reshape(-1)
+        self._file.write(
+            struct.pack("<B", Op.UNITARY)
+            + _pack_qubits(qubits)
+            + struct.pack(f"<{2 * len(entries)}d", *entries.view(np.float64))
+        )
+        self.simulator.apply_unitary(unitary, qubits)
+
+    def to_string(self) -> str:
+        return f"TraceRecorder({self.simulator.to_string()})"
+
+
+def replay(
+    path: str, simulator: qsim.BaseQSimulator, resample: bool = False
+) -> tuple[int, int]:
+    # Returns the number of replayed operations and the number of
+    # measurements whose outcome differs from the recorded one. Measurements,
+    # including those made by resets, collapse onto the recorded outcomes
+    # unless `resample` is set, in which case a replay is a fresh run of the
+    # same gate sequence.
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise Exception(f"{path} is not an RHL trace")
+
+    offset = len(MAGIC)
+    operations = 0
+    mismatches = 0
+    snapshots = []
+    while offset < len(data):
+        (op,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+
+        match op:
+            case Op.QALLOC:
+                qubits, offset = _unpack_qubits(data, offset)
+                if simulator.qalloc(len(qubits)) != qubits:
+                    raise Exception("Trace was recorded with a different register layout")
+            case Op.QFREE:
+                qubits, offset = _unpack_qubits(data, offset)
+                simulator.qfree(qubits)
+            case Op.RESET:
+                qubit, outcome = struct.unpack_from("<IB", data, offset)
+                offset += 5
+                if not resample:
+                    simulator.forced_resets[qubit] = outcome
+            case Op.MEASURE:
+                qubit, outcome = struct.unpack_from("<IB", data, offset)
+                offset += 5
+                if resample:
+                    mismatches += simulator.measure(qubit) != outcome
+                else:
+                    simulator.collapse(qubit, outcome)
+            case Op.GATE:
+                index, target = struct.unpack_from("<BI", data, offset)
+                controls, offset = _unpack_qubits(data, offset + 5)
+                simulator.apply(GATES[index], target, controls)
+            case Op.MATRIX:
+                (target, *parts) = struct.unpack_from("<I8d", data, offset)
+                controls, offset = _unpack_qubits(data, offset + 68)
+                matrix = (np.array(parts[0::2]) + 1j * np.array(parts[1::2])).reshape(2, 2)
+                simulator.apply(matrix, target, controls)
+            case Op.MCZ:
+                qubits, offset = _unpack_qubits(data, offset)
+                simulator.mcz(qubits)
+            case Op.MCPHASE:
+                qubits, offset = _unpack_qubits(data, offset)
+                real, imag = struct.unpack_from("<2d", data, offset)
+                offset += 16
+                simulator.mcphase(qubits, complex(real, imag))
+            case Op.SAMPLE:
+                (shots,) = struct.unpack_from("<I", data, offset)
+                qubits, offset = _unpack_qubits(data, offset + 4)
+                simulator.sample(qubits, shots)
+            case Op.NEW_SHOT:
+                simulator.new_shot()
+                snapshots = []
+            case Op.DIAGONAL:
+                qubits, offset = _unpack_qubits(data, offset)
+                count = 2 * 2 ** len(qubits)
+                parts = np.array(struct.unpack_from(f"<{count}d", data, offset))
+                offset += 8 * count
+                simulator.apply_diagonal(parts.view(complex), qubits)
+            case Op.UNITARY:
+                qubits, offset = _unpack_qubits(data, offset)
+                size = 2 ** len(qubits)
+                count = 2 * size * size
+                parts = np.array(struct.unpack_from(f"<{count}d", data, offset))
+                offset += 8 * count
+                simulator.apply_unitary(parts.view(complex).reshape(size, size), qubits)
+            case Op.SNAPSHOT:
+                snapshots.append(simulator.snapshot())
+            case Op.RESTORE:
+                (back,) = struct.unpack_from("<I", data, offset)
+                offset += 4
+                simulator.restore(snapshots[-back])
+            case Op.RELEASE:
+                (back,) = struct.unpack_from("<I", data, offset)
+                offset += 4
+                simulator.release(snapshots[-back])
+                snapshots[-back] = None
+            case _:
+                raise Exception(f"Invalid trace opcode {op} at offset {offset - 1}")
+
+        operations += 1
+
+    return operations, mismatches
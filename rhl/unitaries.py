@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Iterable
+
+import numpy as np
+
+from . import batch_qsim, circuits, environment, objects, qsim
+
+
+# Subroutines touching more qubits than this are run as circuits, since
+# their operator would be larger than the work it saves.
+MAX_UNITARY_QUBITS = 8
+# Longer calls are interpreted instead of keeping their circuit around.
+MAX_CIRCUIT_GATES = 4096
+MAX_CACHED_UNITARIES = 256
+
+
+@dataclass
+class Compiled:
+    # What a pure subroutine call did, as an optimized circuit and, when it
+    # is small enough, as the operator on `qubits`.
+    circuit: list[circuits.Gate] | None
+    unitary: np.ndarray | None
+    qubits: list[int]
+
+
+_compiled: dict[Hashable, Compiled] = {}
+
+
+class GateRecorder(objects.Object):
+    # Forwards gates to the simulator while keeping them, so the circuit of
+    # a whole subroutine call can be extracted afterwards.
+    # Queries a nested pure call makes; anything else that isn't a gate
+    # (measuring, allocating, ...) couldn't be replayed from the circuit.
+    FORWARDED = {"SUPPORTS_UNITARIES", "max_unitary_qubits"}
+
+    def __init__(self, simulator: qsim.BaseQSimulator):
+        self.simulator = simulator
+        self.gates: list[circuits.Gate] = []
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if name not in self.FORWARDED:
+            raise Exception(f"Pure subroutine called '{name}', which is not a gate")
+        return getattr(self.simulator, name)
+
+    def x(self, qubit: int) -> None:
+        self.apply(qsim.X, qubit)
+
+    def h(self, qubit: int) -> None:
+        self.apply(qsim.H, qubit)
+
+    def cx(self, control: int, target: int) -> None:
+        self.apply(qsim.X, target, (control,))
+
+    def apply(self, op: np.ndarray, target: int, controls: Iterable[int] = ()) -> None:
+        controls = tuple(controls)
+        self.simulator.apply(op, target, controls)
+        self.gates.append(circuits.Gate("apply", (target, *controls), np.asarray(op)))
+
+    def apply_layer(self, ops: Iterable[np.ndarray], qubits: Iterable[int]) -> None:
+        # Kept gate by gate, so the optimizer can merge them with their
+        # neighbours.
+        ops = list(ops)
+        qubits = list(qubits)
+        self.simulator.apply_layer(ops, qubits)
+        for op, qubit in zip(ops, qubits):
+            self.gates.append(circuits.Gate("apply", (qubit,), np.asarray(op)))
+
+    def mcz(self, qubits: list[int]) -> None:
+        qubits = list(qubits)
+        self.simulator.mcz(qubits)
+        self.gates.append(circuits.Gate("mcz", tuple(qubits)))
+
+    def mcphase(self, qubits: Iterable[int], phase: complex) -> None:
+        qubits = list(qubits)
+        self.simulator.mcphase(qubits, phase)
+        self.gates.append(circuits.Gate("mcphase", tuple(qubits), np.asarray(phase)))
+
+    def apply_diagonal(self, diagonal: np.ndarray, qubits: Iterable[int]) -> None:
+        qubits = list(qubits)
+        self.simulator.apply_diagonal(diagonal, qubits)
+        self.gates.append(circuits.Gate("diagonal", tuple(qubits), np.asarray(diagonal)))
+
+    def apply_unitary(self, unitary: np.ndarray, qubits: Iterable[int]) -> None:
+        qubits = list(qubits)
+        self.simulator.apply_unitary(unitary, qubits)
+        self.gates.append(circuits.Gate("unitary", tuple(qubits), np.asarray(unitary)))
+
+    def to_string(self) -> str:
+        return f"GateRecorder({self.simulator.to_string()})"
+
+
+def unitary(circuit: list[circuits.Gate]) -> tuple[np.ndarray, list[int]] | None:
+    qubits = sorted({qubit for gate in circuit for qubit in gate.qubits})
+    if len(qubits) > MAX_UNITARY_QUBITS:
+        return None
+
+    # Running the gates on every basis state at once gives U|j> in row j.
+    local = {qubit: i for i, qubit in enumerate(qubits)}
+    simulator = batch_qsim.BatchQSimulator(len(qubits), shots=2 ** len(qubits))
+    simulator.states[...] = np.eye(2 ** len(qubits))
+    circuits.execute(circuit, simulator, local)
+    return simulator.states.T.copy(), qubits
+
+
+def _qubits_of(argument: objects.Object) -> Hashable:
+    if isinstance(argument, objects.ListObject):
+        return tuple(_qubits_of(item) for item in argument.value)
+    return argument.value
+
+
+def call(
+    declaration: Hashable, arguments: list[objects.Object], run: Callable[[], None]
+) -> None:
+    # Calls a pure subroutine (see Resolver). Its gates only depend on the
+    # arguments, so the first call on the same arguments is recorded, and
+    # later ones apply the cached operator or replay the optimized circuit
+    # without interpreting the body.
+    simulator = environment.GLOBAL_ENV.get_at("qsim", 0)
+    if not simulator.SUPPORTS_UNITARIES:
+        return run()
+
+    key = (declaration, tuple(_qubits_of(argument) for argument in arguments))
+    if key in _compiled:
+        compiled = _compiled[key]
+        if compiled.unitary is not None and (
+            len(compiled.qubits) <= simulator.max_unitary_qubits()
+        ):
+            if compiled.qubits:
+                simulator.apply_unitary(compiled.unitary, compiled.qubits)
+        elif compiled.circuit is not None:
+            circuits.execute(compiled.circuit, simulator)
+        else:
+            run()
+        return
+
+    recorder = GateRecorder(simulator)
+    environment.set_qsim(recorder)
+    try:
+        run()
+    finally:
+        environment.set_qsim(simulator)
+
+    circuit = None
+    if len(recorder.gates) <= MAX_CIRCUIT_GATES:
+        circuit = circuits.optimize(recorder.gates)
+    operator = unitary(circuit if circuit is not None else recorder.gates)
+    unitary_matrix, qubits = operator if operator is not None else (None, [])
+
+    if len(_compiled) >= MAX_CACHED_UNITARIES:
+        _compiled.pop(next(iter(_compiled)))
+    _compiled[key] = Compiled(circuit, unitary_matrix, qubits)
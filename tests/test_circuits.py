@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from rhl import circuits, qsim, unitaries
+from rhl.circuits import Gate
+
+
+NUM_QUBITS = 4
+SINGLE_GATES = [qsim.X, qsim.H, qsim.Z, qsim.S, qsim.T, qsim.S.conj().T]
+
+
+def random_unitary(rng: np.random.Generator, qubits: int) -> np.ndarray:
+    size = 2**qubits
+    q, _ = np.linalg.qr(rng.normal(size=(size, size)) + 1j * rng.normal(size=(size, size)))
+    return q
+
+
+def random_circuit(rng: np.random.Generator) -> list[Gate]:
+    circuit = []
+    for _ in range(rng.integers(1, 30)):
+        qubits = tuple(int(qubit) for qubit in rng.permutation(NUM_QUBITS))
+        controls = int(rng.integers(0, 3))
+        match rng.integers(6):
+            case 0:
+                gate = Gate("apply", qubits[: controls + 1], rng.choice(SINGLE_GATES))
+            case 1:
+                gate = Gate("apply", qubits[:1], random_unitary(rng, 1))
+            case 2:
+                gate = Gate("mcz", qubits[: controls + 1])
+            case 3:
+                gate = Gate("mcphase", qubits[: controls + 1], np.exp(1j * rng.normal()))
+            case 4:
+                entries = np.exp(1j * rng.normal(size=2 ** (controls + 1)))
+                gate = Gate("diagonal", qubits[: controls + 1], entries)
+            case _:
+                gate = Gate("unitary", qubits[:2], random_unitary(rng, 2))
+        circuit.append(gate)
+        # Repeats give the pass something to cancel.
+        if rng.random() < 0.3:
+            circuit.append(circuit[rng.integers(len(circuit))])
+    return circuit
+
+
+def unitary_of(circuit: list[Gate]) -> np.ndarray:
+    # Identities pin the qubit order when a qubit drops out of the circuit.
+    padding = [Gate("apply", (qubit,), qsim.IDENTITY) for qubit in range(NUM_QUBITS)]
+    return unitaries.unitary(circuit + padding)[0]
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_optimize_preserves_the_unitary(seed):
+    circuit = random_circuit(np.random.default_rng(seed))
+    assert np.allclose(unitary_of(circuits.optimize(circuit)), unitary_of(circuit))
+
+
+def test_diffuser_collapses_to_layers_around_mcz():
+    qubits = range(3)
+    h = [Gate("apply", (qubit,), qsim.H) for qubit in qubits]
+    x = [Gate("apply", (qubit,), qsim.X) for qubit in qubits]
+    diffuser = [*h, *x, Gate("mcz", tuple(qubits)), *x, *h]
+
+    optimized = circuits.optimize(diffuser)
+    assert [gate.kind for gate in optimized] == ["layer", "mcz", "layer"]
+    assert np.allclose(unitary_of(optimized), unitary_of(diffuser))
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from rhl import exceptions, objects
+from rhl.interpreter import Interpreter
+
+
+def test_batched_booleans_print_per_shot():
+    value = objects.BooleanObject(value=np.array([True, False]))
+    assert value.to_string() == "true false"
+
+
+def test_branching_on_disagreeing_shots_is_a_runtime_error():
+    condition = objects.BooleanObject(value=np.array([True, False]))
+    with pytest.raises(exceptions.RHLRuntimeError) as error:
+        Interpreter()._is_truthy(condition, None)
+    assert "differs between shots" in error.value.message
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from rhl import partitioned_qsim, qsim
+
+
+@pytest.mark.parametrize("num_qubits, partitions", [(3, 2), (3, 4), (5, 2), (5, 4)])
+def test_partitions_match_dense(num_qubits, partitions):
+    # The top qubits start out global, so most of these gates go through
+    # the swaps that exchange halves between partitions.
+    rng = np.random.default_rng(num_qubits * partitions)
+    dense = qsim.QSimulator(num_qubits)
+    partitioned = partitioned_qsim.PartitionedQSimulator(num_qubits, partitions=partitions)
+    dense.qalloc(num_qubits)
+    partitioned.qalloc(num_qubits)
+    top = num_qubits - 1
+    for simulator in (dense, partitioned):
+        simulator.h(top)
+        simulator.cx(0, top)
+        simulator.cx(top, top - 1)
+
+    for _ in range(30):
+        gate = rng.integers(4)
+        a, b, c = (int(qubit) for qubit in rng.choice(num_qubits, 3, replace=False))
+        for simulator in (dense, partitioned):
+            if gate == 0:
+                simulator.h(a)
+            elif gate == 1:
+                simulator.cx(a, b)
+            elif gate == 2:
+                simulator.apply(qsim.rz_matrix(0.7) @ qsim.H, a, (b, c))
+            else:
+                simulator.apply(qsim.T, a)
+
+    qubits = list(range(num_qubits))
+    assert np.allclose(dense.probabilities(qubits), partitioned.probabilities(qubits))
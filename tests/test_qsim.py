@@ -0,0 +1,118 @@
+import numpy as np
+
+from rhl import qsim, sampling_qsim
+
+
+def test_reallocated_qubit_starts_in_zero():
+    simulator = qsim.QSimulator(2)
+    qubits = simulator.qalloc(1)
+    simulator.x(qubits[0])
+    simulator.qfree(qubits)
+    assert simulator.measure(simulator.qalloc(1)[0]) == 0
+
+
+def test_new_shot_drops_queued_gates():
+    simulator = qsim.QSimulator(2)
+    for qubit in simulator.qalloc(2):
+        simulator.x(qubit)
+    simulator.new_shot()
+    assert [simulator.measure(qubit) for qubit in simulator.qalloc(2)] == [0, 0]
+
+
+def test_memmap_snapshot_survives_freeing_every_qubit(tmp_path):
+    simulator = qsim.QSimulator(4, memmap_path=str(tmp_path / "state.bin"))
+    qubits = simulator.qalloc(4)
+    for qubit in qubits:
+        simulator.h(qubit)
+    simulator.state_vector
+    snapshot = simulator.snapshot()
+    simulator.qfree(qubits)
+    simulator.restore(snapshot)
+    assert simulator.probabilities([0, 1]).tolist() == [0.25] * 4
+
+
+def test_new_shot_drops_snapshots():
+    simulator = qsim.QSimulator(2)
+    simulator.h(simulator.qalloc(1)[0])
+    simulator.snapshots.append(simulator.snapshot())
+    simulator.new_shot()
+    assert simulator.snapshots == []
+
+
+def test_mcphase_matches_diagonal():
+    phase = np.exp(0.7j)
+    diagonal = np.ones(4, dtype=complex)
+    diagonal[-1] = phase
+    states = []
+    for apply in (
+        lambda simulator, qubits: simulator.apply_diagonal(diagonal, qubits),
+        lambda simulator, qubits: simulator.mcphase(qubits, phase),
+    ):
+        simulator = qsim.QSimulator(3)
+        qubits = simulator.qalloc(3)
+        for qubit in qubits:
+            simulator.h(qubit)
+        apply(simulator, [qubits[2], qubits[0]])
+        states.append(simulator.state_vector.copy())
+    assert np.allclose(*states)
+
+
+def test_sampling_simulator_keeps_memmap(tmp_path):
+    simulator = sampling_qsim.SamplingQSimulator(
+        2, memmap_path=str(tmp_path / "state.bin"), shots=4
+    )
+    qubits = simulator.qalloc(2)
+    simulator.x(qubits[1])
+    assert simulator.measure(qubits[1]) == 1
+    assert isinstance(simulator.state_vector, np.memmap)
+
+
+def test_norm_squared_of_many_axes():
+    ndim = 27
+    view = np.lib.stride_tricks.as_strided(
+        np.full(1, 0.5 + 0.5j), shape=(2,) * ndim, strides=(0,) * ndim
+    )
+    assert qsim.norm_squared(view) == 2**ndim / 2
+
+
+def test_sampling_streams_through_blocks():
+    # Blocks of 4 amplitudes, so the search crosses several of them.
+    shots = 20000
+    simulator = sampling_qsim.SamplingQSimulator(4, shots=shots, seed=3)
+    simulator.MEMMAP_BLOCK_QUBITS = 2
+    counts = np.zeros(16)
+    for _ in range(shots):
+        simulator.new_shot()
+        qubits = simulator.qalloc(4)
+        simulator.h(qubits[0])
+        simulator.apply(qsim.rz_matrix(0.3) @ qsim.H, qubits[3])
+        simulator.cx(qubits[3], qubits[2])
+        counts[simulator.measure_all(qubits)] += 1
+
+    # qubits[0] and qubits[3] are uniform, and qubits[2] copies qubits[3].
+    expected = np.zeros(16)
+    expected[[0b0000, 0b0001, 0b1100, 0b1101]] = 0.25
+    assert not counts[expected == 0].any()
+    assert np.allclose(counts / shots, expected, atol=0.02)
+
+
+def test_measure_all_streams_through_blocks():
+    shots = 4000
+    simulator = qsim.QSimulator(4, seed=5)
+    simulator.MEMMAP_BLOCK_QUBITS = 2
+    counts = np.zeros(4)
+    for _ in range(shots):
+        simulator.new_shot()
+        qubits = simulator.qalloc(4)
+        simulator.h(qubits[0])
+        simulator.h(qubits[1])
+        simulator.cx(qubits[1], qubits[3])
+        simulator.h(qubits[2])
+        outcome = simulator.measure_all([qubits[3], qubits[1]])
+        counts[outcome] += 1
+        # The unmeasured qubits are left alone and the measured ones stay put.
+        assert simulator.measure(qubits[1]) == outcome >> 1
+        assert np.isclose(simulator.probabilities([qubits[0], qubits[2]]), 0.25).all()
+
+    assert counts[0b01] == counts[0b10] == 0
+    assert np.allclose(counts / shots, [0.5, 0, 0, 0.5], atol=0.03)
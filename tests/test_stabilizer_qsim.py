@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from rhl import qsim, stabilizer_qsim
+
+
+class FakeNode:
+    # Just enough of node.Node for is_clifford_program.
+    def __init__(self, type: str, **fields: list["FakeNode"]):
+        self.type = type
+        self.fields = fields
+
+    def get_all(self, field: str) -> list["FakeNode"]:
+        return self.fields.get(field, [])
+
+
+def mcz_call(count: int) -> FakeNode:
+    qubits = FakeNode("list", value=[FakeNode("index") for _ in range(count)])
+    return FakeNode("call", argument=[qubits])
+
+
+@pytest.mark.parametrize("count, clifford", [(1, True), (2, True), (3, False)])
+def test_mcz_is_clifford_on_at_most_two_qubits(count, clifford):
+    call = mcz_call(count)
+    assert stabilizer_qsim.is_clifford_program({"mcz": [call]}, {"mcz": [call]}) == clifford
+
+
+def test_mcz_passed_as_value_is_not_clifford():
+    call = mcz_call(2)
+    references = {"mcz": [call, FakeNode("identifier")]}
+    assert not stabilizer_qsim.is_clifford_program(references, {"mcz": [call]})
+
+
+def test_non_clifford_builtin_is_not_clifford():
+    references = {"h": [FakeNode("identifier")], "t": [FakeNode("identifier")]}
+    assert not stabilizer_qsim.is_clifford_program(references, {})
+    assert stabilizer_qsim.is_clifford_program({"h": references["h"]}, {})
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_clifford_circuits_match_dense(seed):
+    # Every outcome of the tableau must have probability 1 in the state
+    # vector, or 1/2 when the tableau draws it at random.
+    rng = np.random.default_rng(seed)
+    num_qubits = 5
+    stabilizer = stabilizer_qsim.StabilizerQSimulator(num_qubits, seed=seed)
+    dense = qsim.QSimulator(num_qubits)
+    stabilizer.qalloc(num_qubits)
+    dense.qalloc(num_qubits)
+
+    def measure(qubit: int) -> None:
+        probability = dense.probabilities([qubit])[1]
+        # The outcome is random iff a stabilizer anticommutes with Z_qubit.
+        random = stabilizer.xs[num_qubits : 2 * num_qubits, qubit].any()
+        outcome = stabilizer.measure(qubit)
+        assert np.isclose(probability, 0.5 if random else outcome)
+        dense.collapse(qubit, outcome)
+
+    for _ in range(60):
+        gate = rng.integers(8)
+        a, b = (int(qubit) for qubit in rng.choice(num_qubits, 2, replace=False))
+        if gate == 7:
+            measure(a)
+            continue
+        for simulator in (stabilizer, dense):
+            if gate == 0:
+                simulator.h(a)
+            elif gate == 1:
+                simulator.cx(a, b)
+            elif gate == 2:
+                simulator.mcz([a, b])
+            elif gate == 3:
+                simulator.apply(qsim.S, a)
+            elif gate == 4:
+                simulator.apply(qsim.Z, a)
+            elif gate == 5:
+                simulator.apply(qsim.Z, a, (b,))
+            else:
+                simulator.x(a)
+
+    for qubit in range(num_qubits):
+        measure(qubit)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from rhl import qsim, trace
+
+
+def _record(path: str) -> np.ndarray:
+    recorder = trace.TraceRecorder(qsim.QSimulator(3, seed=1), str(path))
+    qubits = recorder.qalloc(3)
+    for qubit in qubits:
+        recorder.h(qubit)
+    recorder.measure_all(qubits[:2])
+    recorder.close()
+    return recorder.simulator.state_vector
+
+
+def test_replay_enforces_recorded_outcomes(tmp_path):
+    recorded = _record(tmp_path / "trace.bin")
+    for seed in range(5):
+        simulator = qsim.QSimulator(3, seed=seed)
+        assert trace.replay(str(tmp_path / "trace.bin"), simulator) == (9, 0)
+        assert np.allclose(simulator.state_vector, recorded)
+
+
+@pytest.mark.parametrize("reallocate", [False, True])
+def test_replay_enforces_reset_outcomes(tmp_path, reallocate):
+    # Freeing the top qubit traces it out; freeing the bottom one leaves it
+    # to be reset by the next qalloc. Either way the simulator measures it.
+    path = str(tmp_path / "trace.bin")
+    for seed in range(20):
+        recorder = trace.TraceRecorder(qsim.QSimulator(2, seed=seed), path)
+        low, high = recorder.qalloc(2)
+        recorder.h(low)
+        recorder.cx(low, high)
+        if reallocate:
+            recorder.qfree([low])
+            recorder.qalloc(1)
+            recorder.measure(high)
+        else:
+            recorder.qfree([high])
+            recorder.measure(low)
+        recorder.close()
+        for replay_seed in range(5):
+            trace.replay(path, qsim.QSimulator(2, seed=replay_seed))
+
+
+def test_collapse_rejects_impossible_outcome():
+    simulator = qsim.QSimulator(1)
+    qubit = simulator.qalloc(1)[0]
+    with pytest.raises(Exception, match="probability zero"):
+        simulator.collapse(qubit, 1)
@@ -0,0 +1,12 @@
+import pytest
+
+from rhl import qsim, unitaries
+
+
+def test_recorder_rejects_non_gates():
+    simulator = qsim.QSimulator(1)
+    recorder = unitaries.GateRecorder(simulator)
+    recorder.h(simulator.qalloc(1)[0])
+    with pytest.raises(Exception, match="not a gate"):
+        recorder.measure(0)
+    assert recorder.SUPPORTS_UNITARIES